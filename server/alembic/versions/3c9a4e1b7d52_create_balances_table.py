@@ -0,0 +1,40 @@
+"""create_balances_table
+
+Revision ID: 3c9a4e1b7d52
+Revises: 56d7e40c6526
+Create Date: 2026-10-18 10:12:31.418207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c9a4e1b7d52'
+down_revision = '56d7e40c6526'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "balances",
+        sa.Column("user_id", sa.String, sa.ForeignKey("users.id"), primary_key=True),
+        sa.Column("amount", sa.Float, nullable=False, server_default="0"),
+    )
+    # Backfill from transaction history, REQUESTs never move money
+    op.execute("""
+        INSERT INTO balances (user_id, amount)
+        SELECT user_id, SUM(amount) FROM (
+            SELECT receiver_id AS user_id, amount FROM transactions
+            WHERE type != 'REQUEST'
+            UNION ALL
+            SELECT sender_id AS user_id, -amount FROM transactions
+            WHERE type != 'REQUEST' AND sender_id IS NOT NULL
+        ) AS entries
+        GROUP BY user_id
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table("balances")
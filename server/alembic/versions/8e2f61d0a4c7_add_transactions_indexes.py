@@ -0,0 +1,55 @@
+"""add_transactions_indexes
+
+Revision ID: 8e2f61d0a4c7
+Revises: 3c9a4e1b7d52
+Create Date: 2026-10-18 11:02:47.930114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e2f61d0a4c7'
+down_revision = '3c9a4e1b7d52'
+branch_labels = None
+depends_on = None
+
+# REQUESTs never move money, balance aggregation only reads the other types
+balance_filter = sa.text("type != 'REQUEST'")
+
+
+def upgrade() -> None:
+    # Listing of a user's transactions, newest first
+    op.create_index(
+        "ix_transactions_sender_id_timestamp",
+        "transactions",
+        ["sender_id", "timestamp"]
+    )
+    op.create_index(
+        "ix_transactions_receiver_id_timestamp",
+        "transactions",
+        ["receiver_id", "timestamp"]
+    )
+    # Covering indexes for balance aggregation (index only scans)
+    op.create_index(
+        "ix_transactions_sender_id_balance",
+        "transactions",
+        ["sender_id"],
+        postgresql_include=["amount"],
+        postgresql_where=balance_filter
+    )
+    op.create_index(
+        "ix_transactions_receiver_id_balance",
+        "transactions",
+        ["receiver_id"],
+        postgresql_include=["amount"],
+        postgresql_where=balance_filter
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_transactions_receiver_id_balance", "transactions")
+    op.drop_index("ix_transactions_sender_id_balance", "transactions")
+    op.drop_index("ix_transactions_receiver_id_timestamp", "transactions")
+    op.drop_index("ix_transactions_sender_id_timestamp", "transactions")
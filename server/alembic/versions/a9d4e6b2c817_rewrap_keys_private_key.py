@@ -0,0 +1,76 @@
+"""rewrap_keys_private_key
+
+Revision ID: a9d4e6b2c817
+Revises: e5c71a9f3b28
+Create Date: 2026-10-18 14:52:09.671240
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.crypto_utils import (
+    deserialize_private_key,
+    encrypt_private_key,
+    is_encrypted_envelope,
+    serialize_private_key
+)
+
+
+# revision identifiers, used by Alembic.
+revision = 'a9d4e6b2c817'
+down_revision = 'e5c71a9f3b28'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 500
+
+keys = sa.table(
+    "keys",
+    sa.column("id", sa.Integer),
+    sa.column("public_key", sa.LargeBinary),
+    sa.column("private_key", sa.LargeBinary),
+)
+
+
+def rewrap_private_keys(encrypt, is_converted):
+    """
+    Re-encrypt private keys not yet `is_converted` with `encrypt`, in batches of ids
+    """
+    connection = op.get_bind()
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(keys.c.id, keys.c.public_key, keys.c.private_key)
+            .where(keys.c.id > last_id)
+            .order_by(keys.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        updates = [
+            {
+                "key_id": key_id,
+                "private_key": encrypt(deserialize_private_key(private_key, public_key))
+            }
+            for key_id, public_key, private_key in rows
+            if not is_converted(private_key)
+        ]
+        if updates:
+            connection.execute(
+                keys.update()
+                .where(keys.c.id == sa.bindparam("key_id"))
+                .values(private_key=sa.bindparam("private_key")),
+                updates
+            )
+
+
+def upgrade() -> None:
+    rewrap_private_keys(encrypt_private_key, is_encrypted_envelope)
+
+
+def downgrade() -> None:
+    rewrap_private_keys(
+        serialize_private_key,
+        lambda private_key: not is_encrypted_envelope(private_key)
+    )
@@ -0,0 +1,70 @@
+"""create_balance_checkpoints_table
+
+Revision ID: b71d3f9c2e05
+Revises: 8e2f61d0a4c7
+Create Date: 2026-10-18 12:20:05.114382
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b71d3f9c2e05'
+down_revision = '8e2f61d0a4c7'
+branch_labels = None
+depends_on = None
+
+balance_filter = sa.text("type != 'REQUEST'")
+
+
+def upgrade() -> None:
+    op.add_column(
+        "transactions",
+        sa.Column("created_at", sa.DateTime, nullable=True, server_default=sa.func.now())
+    )
+    op.execute("UPDATE transactions SET created_at = COALESCE(timestamp, now())")
+    op.alter_column("transactions", "created_at", nullable=False)
+
+    op.create_table(
+        "balance_checkpoints",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("user_id", sa.String, sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("balance", sa.Float, nullable=False),
+        sa.Column("as_of_timestamp", sa.DateTime, nullable=False),
+        sa.Column("last_transaction_id", sa.String, nullable=False),
+        sa.Column("signature", sa.LargeBinary, nullable=False),
+        sa.Column("created_at", sa.DateTime, nullable=False, server_default=sa.func.now()),
+    )
+    op.create_index(
+        "ix_balance_checkpoints_user_id_position",
+        "balance_checkpoints",
+        ["user_id", "as_of_timestamp", "last_transaction_id"]
+    )
+
+    # Balance indexes now also serve aggregation of transactions after a checkpoint
+    for column in ("sender_id", "receiver_id"):
+        op.drop_index(f"ix_transactions_{column}_balance", "transactions")
+        op.create_index(
+            f"ix_transactions_{column}_balance",
+            "transactions",
+            [column, "created_at", "id"],
+            postgresql_include=["amount"],
+            postgresql_where=balance_filter
+        )
+
+
+def downgrade() -> None:
+    for column in ("sender_id", "receiver_id"):
+        op.drop_index(f"ix_transactions_{column}_balance", "transactions")
+        op.create_index(
+            f"ix_transactions_{column}_balance",
+            "transactions",
+            [column],
+            postgresql_include=["amount"],
+            postgresql_where=balance_filter
+        )
+
+    op.drop_index("ix_balance_checkpoints_user_id_position", "balance_checkpoints")
+    op.drop_table("balance_checkpoints")
+    op.drop_column("transactions", "created_at")
@@ -0,0 +1,43 @@
+"""add_transactions_keyset_indexes
+
+Revision ID: d4a8c0e6f193
+Revises: b71d3f9c2e05
+Create Date: 2026-10-18 13:41:56.208731
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4a8c0e6f193'
+down_revision = 'b71d3f9c2e05'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        "ix_transactions_timestamp_id",
+        "transactions",
+        [sa.text("timestamp DESC"), sa.text("id DESC")]
+    )
+    # id breaks ties of timestamp in keyset pagination of a user's transactions
+    for column in ("sender_id", "receiver_id"):
+        op.drop_index(f"ix_transactions_{column}_timestamp", "transactions")
+        op.create_index(
+            f"ix_transactions_{column}_timestamp",
+            "transactions",
+            [column, "timestamp", "id"]
+        )
+
+
+def downgrade() -> None:
+    for column in ("sender_id", "receiver_id"):
+        op.drop_index(f"ix_transactions_{column}_timestamp", "transactions")
+        op.create_index(
+            f"ix_transactions_{column}_timestamp",
+            "transactions",
+            [column, "timestamp"]
+        )
+    op.drop_index("ix_transactions_timestamp_id", "transactions")
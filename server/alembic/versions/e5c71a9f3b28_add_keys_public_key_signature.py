@@ -0,0 +1,75 @@
+"""add_keys_public_key_signature
+
+Revision ID: e5c71a9f3b28
+Revises: d4a8c0e6f193
+Create Date: 2026-10-18 14:31:47.203518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.crypto_utils import load_server_key_pair
+from app.crypto_utils.encryption_provider import EncryptionProvider
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5c71a9f3b28'
+down_revision = 'd4a8c0e6f193'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+keys = sa.table(
+    "keys",
+    sa.column("id", sa.Integer),
+    sa.column("public_key", sa.LargeBinary),
+    sa.column("public_key_signature", sa.LargeBinary),
+)
+
+
+def _load_server_private_key():
+    """
+    Load the existing server key, a new key would sign keys the server can't vouch for
+    """
+    try:
+        private_key, _ = load_server_key_pair("server_key", create=False)
+    except (FileNotFoundError, ValueError) as exc:
+        raise RuntimeError(
+            "Existing keys have to be signed with the server key, "
+            "run the migration where server_key and server_key.pub can be loaded"
+        ) from exc
+    return private_key
+
+
+def upgrade() -> None:
+    op.add_column("keys", sa.Column("public_key_signature", sa.LargeBinary, nullable=True))
+
+    # Sign existing public keys with the server key, in batches to bound memory
+    connection = op.get_bind()
+    private_key = None
+    while True:
+        rows = connection.execute(
+            sa.select(keys.c.id, keys.c.public_key)
+            .where(keys.c.public_key_signature.is_(None))
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        if private_key is None:
+            private_key = _load_server_private_key()
+        connection.execute(
+            keys.update()
+            .where(keys.c.id == sa.bindparam("key_id"))
+            .values(public_key_signature=sa.bindparam("signature")),
+            [
+                {"key_id": key_id, "signature": EncryptionProvider.sign(public_key, private_key)}
+                for key_id, public_key in rows
+            ]
+        )
+
+    op.alter_column("keys", "public_key_signature", nullable=False)
+
+
+def downgrade() -> None:
+    op.drop_column("keys", "public_key_signature")
@@ -0,0 +1,78 @@
+"""
+Cache of authenticated users
+
+Cached users are invalidated when the user or any of their keys are modified
+through the ORM and committed, changes from elsewhere are picked up after `USER_CACHE_TTL`
+"""
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from app.auth.db_models import User
+from app.crypto_utils.db_models import Key
+from app.metrics import register_metrics
+from app.settings import USER_CACHE_SIZE, USER_CACHE_TTL
+from app.utils.cache import LRUCache
+
+user_cache = LRUCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+register_metrics("user_cache", user_cache.metrics)
+
+# Key in `Session.info` of users modified in the current transaction
+_MODIFIED_USERS = "modified_users"
+
+
+def invalidate_user(user_id):
+    """
+    Remove user from cache
+    """
+    user_cache.pop(user_id)
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+# pylint: disable=unused-argument
+def _user_modified(mapper, connection, target):
+    """
+    Invalidate modified user on commit
+    """
+    _invalidate_on_commit(target, target.id)
+
+
+@event.listens_for(Key, "after_insert")
+@event.listens_for(Key, "after_update")
+@event.listens_for(Key, "after_delete")
+# pylint: disable=unused-argument
+def _key_modified(mapper, connection, target):
+    """
+    Invalidate owner of modified key on commit, active key may have changed
+    """
+    _invalidate_on_commit(target, target.user_id)
+
+
+def _invalidate_on_commit(target, user_id):
+    """
+    Record user to be invalidated once the session of `target` commits
+
+    Invalidating on flush would let other requests cache the user as it was before the commit
+    """
+    database = object_session(target)
+    if database is None:
+        invalidate_user(user_id)
+    else:
+        database.info.setdefault(_MODIFIED_USERS, set()).add(user_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _session_committed(database):
+    """
+    Invalidate users modified in the committed transaction
+    """
+    for user_id in database.info.pop(_MODIFIED_USERS, ()):
+        invalidate_user(user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _session_rolled_back(database):
+    """
+    Forget users modified in the rolled back transaction, cached users are still current
+    """
+    database.info.pop(_MODIFIED_USERS, None)
@@ -7,7 +7,7 @@ from pydantic import BaseModel
 
 from app.datamodels import Password, PhoneNumber
 from app.crypto_utils.datamodels import UserKeys
-from app.utils import sign_balance
+from app.utils import sign_user_balance
 
 
 class UserCreate(PhoneNumber, Password):
@@ -24,6 +24,28 @@ class TokenData(BaseModel):
     token_type: str = "Bearer"
 
 
+class UserSnapshot(BaseModel):
+    """
+    Detached snapshot of authenticated user
+    """
+    id: str
+    phone_number: str
+    name: str
+    public_key: Optional[bytes]
+
+    @classmethod
+    def from_user(cls, user):
+        """
+        Create snapshot from user orm object
+        """
+        return cls(
+            id=user.id,
+            phone_number=user.phone_number,
+            name=user.name,
+            public_key=user.keys.public_key if user.keys else None
+        )
+
+
 class User(PhoneNumber):
     """
     Response datamodel for user
@@ -38,7 +60,7 @@ class User(PhoneNumber):
         """
         Set balance and signature
         """
-        self.balance = sign_balance(amount)
+        self.balance = sign_user_balance(self.id, amount)
 
     class Config:
         """Enable ORM mode"""
@@ -1,19 +1,49 @@
 """
 DB layer for auth and users
 """
+from sqlalchemy.orm import joinedload, load_only, noload
+
 from app.auth.db_models import User
 from app.auth.utils import get_password_hash
 from app.crypto_utils.db_crud import db_create_user_key_pair
+from app.crypto_utils.db_models import Key
+
+# Columns loaded with users
+#   id: only the id, to check users exist
+#   auth: user columns and the active public key, to authenticate
+#   profile: user and the active key pair, to hand over to the user
+LOAD_PROFILES = {
+    "id": (load_only(User.id), noload(User.keys)),
+    "auth": (
+        load_only(User.id, User.phone_number, User.name, User.password),
+        joinedload(User.keys).load_only(Key.public_key),
+    ),
+    "profile": (joinedload(User.keys).undefer(Key.private_key),),
+}
+
+
+def _query_users(database, profile):
+    """
+    Query users loading columns of `profile`
+
+    Users already in the session are refreshed, they may have been loaded by another profile.
+    The id profile only checks that users exist and leaves them as they are
+    """
+    query = database.query(User).options(*LOAD_PROFILES[profile])
+    return query if profile == "id" else query.populate_existing()
+
 
-def db_create_user(database, new_user, commit=True):
+def db_create_user(database, new_user, commit=True, password_hash=None):
     """
     Create new user in database
+
+    Password is hashed here unless already hashed as `password_hash`
     """
-    conflict = db_get_user_by_phone_number(database, new_user.phone_number)
+    conflict = db_get_user_by_phone_number(database, new_user.phone_number, "id")
     if conflict:
         raise ValueError("Phone number already used")
     user_obj = User(**new_user.dict())
-    user_obj.password = get_password_hash(user_obj.password)
+    user_obj.password = password_hash or get_password_hash(user_obj.password)
     database.add(user_obj)
     if commit:
         database.commit()
@@ -23,25 +53,34 @@ def db_create_user(database, new_user, commit=True):
     return user_obj
 
 
-def db_get_user_by_id(database, user_id):
+def db_update_user_password(database, user, password_hash, commit=True):
+    """
+    Update password hash of user
+    """
+    user.password = password_hash
+    if commit:
+        database.commit()
+
+
+def db_get_user_by_id(database, user_id, profile="profile"):
     """
-    Select user by id in database
+    Select user by id in database, with columns of load `profile`
     """
-    return database.query(User).get(user_id)
+    return _query_users(database, profile).filter(User.id == user_id).one_or_none()
 
 
-def db_get_user_by_phone_number(database, phone_number):
+def db_get_user_by_phone_number(database, phone_number, profile="profile"):
     """
-    Select user by phone number in database
+    Select user by phone number in database, with columns of load `profile`
     """
-    return database.query(User).filter_by(phone_number=phone_number).first()
+    return _query_users(database, profile).filter_by(phone_number=phone_number).first()
 
 
-def db_list_users(database, user_ids = None):
+def db_list_users(database, user_ids = None, profile="profile"):
     """
-    List all users from database
+    List all users from database, with columns of load `profile`
     """
-    query = database.query(User)
+    query = _query_users(database, profile)
 
     if user_ids is not None:
         query = query.filter(
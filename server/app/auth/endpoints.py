@@ -5,12 +5,24 @@ Prefix: /auth
 """
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.security import OAuth2PasswordRequestForm
+from starlette.concurrency import run_in_threadpool
 
 from app.auth.datamodels import TokenData, UserCreate, User
 from app.auth.policies import get_current_user, no_auth
-from app.auth.db_crud import db_create_user, db_get_user_by_phone_number
-from app.auth.utils import create_access_token, verify_password
-from app.database.dependency import get_db
+from app.auth.db_crud import (
+    db_create_user,
+    db_get_user_by_id,
+    db_get_user_by_phone_number,
+    db_update_user_password
+)
+from app.auth.utils import (
+    create_access_token,
+    get_password_hash,
+    run_password_job,
+    verify_and_update_password
+)
+from app.database.connection import run_db
+from app.database.dependency import get_async_db, get_db
 from app.exceptions import NOT_AUTHENTICATED
 from app.payments.db_crud import db_calculate_balance
 
@@ -21,7 +33,7 @@ router = APIRouter(
 
 
 @router.post("/users", dependencies=[Depends(no_auth)], status_code=201)
-def create_user(new_user: UserCreate, database = Depends(get_db)):
+async def create_user(new_user: UserCreate, database = Depends(get_db)):
     """
     POST /auth/users
 
@@ -30,9 +42,19 @@ def create_user(new_user: UserCreate, database = Depends(get_db)):
     raises 409 if phone number is already used
 
     raises 403 if authenticated
+
+    raises 503 if too many passwords are waiting to be hashed
+    """
+    password_hash = await run_password_job(get_password_hash, new_user.password)
+    return await run_in_threadpool(_create_user, database, new_user, password_hash)
+
+
+def _create_user(database, new_user, password_hash):
+    """
+    Create user with hashed password and return the response
     """
     try:
-        user = db_create_user(database, new_user, False)
+        user = db_create_user(database, new_user, False, password_hash)
         database.commit()
         database.refresh(user)
         user = User.from_orm(user)
@@ -44,7 +66,10 @@ def create_user(new_user: UserCreate, database = Depends(get_db)):
 
 
 @router.post("/login", dependencies=[Depends(no_auth)])
-def login(data: OAuth2PasswordRequestForm = Depends(), database = Depends(get_db)):
+async def login(
+    data: OAuth2PasswordRequestForm = Depends(),
+    database = Depends(get_async_db)
+):
     """
     POST /auth/login
 
@@ -53,10 +78,19 @@ def login(data: OAuth2PasswordRequestForm = Depends(), database = Depends(get_db
     raises 403 if authenticated
 
     raises 401 if username, password wrong
+
+    raises 503 if too many passwords are waiting to be verified
     """
-    user_in_db = db_get_user_by_phone_number(database, data.username)
+    user_in_db = await run_db(database, db_get_user_by_phone_number, data.username, "auth")
     if user_in_db is not None:
-        if verify_password(data.password, user_in_db.password):
+        valid, new_hash = await run_password_job(
+            verify_and_update_password,
+            data.password,
+            user_in_db.password
+        )
+        if valid:
+            if new_hash is not None:
+                await run_db(database, db_update_user_password, user_in_db, new_hash)
             return TokenData(access_token=create_access_token(user_in_db.id))
     raise NOT_AUTHENTICATED
 
@@ -68,6 +102,6 @@ def get_me(database = Depends(get_db), current_user = Depends(get_current_user))
 
     Get details of currently authenticated user
     """
-    user = User.from_orm(current_user)
+    user = User.from_orm(db_get_user_by_id(database, current_user.id))
     user.set_balance(db_calculate_balance(database, current_user.id))
     return user
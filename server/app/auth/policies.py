@@ -1,23 +1,38 @@
 """
 Auth policies
 """
+import hmac
+
 from fastapi import Depends, Request
 
 from app.auth.utils import oauth2_scheme
 from app.exceptions import NOT_AUTHENTICATED, PERMISSION_DENIED
+from app.middleware import get_request_user
+from app.settings import METRICS_TOKEN
 
 def get_current_user(request: Request, _ = Depends(oauth2_scheme)):
     """
     Only allow authenticated users and return current user
     """
-    if request.state.user is None:
+    user = get_request_user(request)
+    if user is None:
         raise NOT_AUTHENTICATED
-    return request.state.user
+    return user
 
 
 def no_auth(request: Request):
     """
     Only allow non authenticated users
     """
-    if request.state.user is not None:
+    if get_request_user(request) is not None:
+        raise PERMISSION_DENIED
+
+
+def metrics_access(request: Request):
+    """
+    Only allow requests with the `METRICS_TOKEN` bearer token
+    """
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if METRICS_TOKEN is None or scheme.lower() != "bearer" or \
+            not hmac.compare_digest(token.encode("utf-8"), METRICS_TOKEN.encode("utf-8")):
         raise PERMISSION_DENIED
@@ -1,13 +1,30 @@
 """
 Tests for auth
 """
+import time
+
 from faker import Faker
 from fastapi.testclient import TestClient
-from app.auth.db_crud import db_create_user, db_get_user_by_phone_number
-from app.auth.utils import create_access_token, decode_token
+from jose import jwt
+from app.auth.cache import user_cache
+from app.auth.db_crud import (
+    db_create_user,
+    db_get_user_by_id,
+    db_get_user_by_phone_number
+)
+from app.auth.utils import (
+    create_access_token,
+    decode_token,
+    revoke_token,
+    revoked_tokens,
+    token_cache,
+    _token_digest
+)
 
 from app.database.seed import create_user
 from app.main import app
+from app.settings import ALGORITHM, SECRET_KEY, TOKEN_CACHE_SIZE
+from app.utils import verify_balance_token
 
 client = TestClient(app)
 
@@ -200,3 +217,98 @@ def test_me(db_session):
     req = client.get(url, headers={"Authorization": f"Bearer {token}"})
     assert req.status_code == 200
     assert req.json()["id"] == user.id
+    assert verify_balance_token(req.json()["balance"])
+
+
+def test_load_profiles(db_session):
+    """
+    Test users already loaded by another profile in the session get the columns of the profile
+    """
+    user_id = db_create_user(db_session, create_user()).id
+    db_session.expunge_all()
+
+    user = db_get_user_by_id(db_session, user_id, "id")
+    assert user.keys is None
+
+    user = db_get_user_by_id(db_session, user_id, "profile")
+    assert user.keys.private_key is not None
+
+    user = db_get_user_by_id(db_session, user_id, "auth")
+    assert user.keys.public_key is not None
+    assert user.password is not None
+
+
+def test_user_cache(db_session):
+    """
+    Test caching of authenticated user
+
+    Test invalidation on commit of modification of user
+    """
+    user = db_create_user(db_session, create_user())
+    token = create_access_token(user.id)
+    req = client.get("/auth/me", headers={"Authorization": f"Bearer {token}"})
+    assert req.status_code == 200
+    assert user_cache.get(user.id).public_key == user.keys.public_key
+
+    user.name = fake.name()
+    db_session.flush()
+    db_session.rollback()
+    assert user_cache.get(user.id) is not None
+
+    user.name = fake.name()
+    db_session.flush()
+    assert user_cache.get(user.id) is not None
+    db_session.commit()
+    assert user_cache.get(user.id) is None
+
+    req = client.get("/auth/me", headers={"Authorization": f"Bearer {token}"})
+    assert req.json()["name"] == user.name
+
+
+def test_token_revocation(db_session):
+    """
+    Test revoked tokens are rejected even if cached
+    """
+    user = db_create_user(db_session, create_user())
+    token = create_access_token(user.id)
+    assert decode_token(token) == user.id
+    assert decode_token(token) == user.id
+
+    revoke_token(token)
+    assert decode_token(token) is None
+    req = client.get("/auth/me", headers={"Authorization": f"Bearer {token}"})
+    assert req.status_code == 401
+
+
+def test_token_revocation_kept_until_expiry(db_session):
+    """
+    Test revocations aren't evicted by other revocations, and apply to tokens cached after them
+    """
+    user = db_create_user(db_session, create_user())
+    token = create_access_token(user.id)
+    revoke_token(token)
+    for user_id in range(TOKEN_CACHE_SIZE + 1):
+        revoke_token(create_access_token(user_id))
+    assert decode_token(token) is None
+
+    # Token cached by a request that raced with the revocation
+    token = jwt.encode(
+        {"sub": user.id, "exp": int(time.time()) + 3600},
+        SECRET_KEY,
+        algorithm=ALGORITHM
+    )
+    assert decode_token(token) == user.id
+    revoke_token(token)
+    token_cache.set(_token_digest(token), (user.id, float("inf")))
+    assert decode_token(token) is None
+    assert len(revoked_tokens) > TOKEN_CACHE_SIZE
+
+
+def test_token_invalid_expiry():
+    """
+    Test tokens with a non numeric exp are rejected and can be revoked
+    """
+    token = jwt.encode({"sub": "1", "exp": "never"}, SECRET_KEY, algorithm=ALGORITHM)
+    assert decode_token(token) is None
+    revoke_token(token)
+    assert decode_token(token) is None
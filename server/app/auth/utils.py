@@ -3,19 +3,98 @@ Utils for auth module
 
 Tokens and password hashing
 """
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta, datetime
+import hashlib
+import threading
+import time
 
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 from fastapi.security import OAuth2PasswordBearer
 
-from app.settings import ACCESS_TOKEN_EXPIRE_MINUTES, ALGORITHM, BASE_PATH, SECRET_KEY
+from app.exceptions import SERVER_BUSY
+from app.metrics import register_metrics
+from app.settings import (
+    ACCESS_TOKEN_EXPIRE_MINUTES,
+    ALGORITHM,
+    BASE_PATH,
+    BCRYPT_ROUNDS,
+    PASSWORD_HASH_QUEUE_SIZE,
+    PASSWORD_HASH_WORKERS,
+    SECRET_KEY,
+    TOKEN_CACHE_SIZE
+)
+from app.utils.cache import ExpiringSet, LRUCache
 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Hashes of any other cost than `BCRYPT_ROUNDS` are updated on login
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS
+)
+
+# Dedicated to bcrypt so that login spikes don't starve the request threads
+password_executor = ThreadPoolExecutor(
+    max_workers=PASSWORD_HASH_WORKERS,
+    thread_name_prefix="password-hash"
+)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"{BASE_PATH}/auth/login")
 
+# (user_id, exp) of verified tokens by SHA-256 of token
+token_cache = LRUCache(TOKEN_CACHE_SIZE)
+register_metrics("token_cache", token_cache.metrics)
+
+# SHA-256 of revoked tokens, kept until the tokens expire
+revoked_tokens = ExpiringSet()
+
+
+class _PasswordQueue:
+    """
+    Depth of password executor queue (queued and running jobs)
+    """
+    depth = 0
+    rejected = 0
+    lock = threading.Lock()
+
+    @classmethod
+    def metrics(cls):
+        """
+        Queue depth of password executor
+        """
+        return {
+            "workers": PASSWORD_HASH_WORKERS,
+            "max_queue_depth": PASSWORD_HASH_QUEUE_SIZE,
+            "queue_depth": cls.depth,
+            "rejected": cls.rejected,
+        }
+
+
+register_metrics("password_hashing", _PasswordQueue.metrics)
+
+
+async def run_password_job(function, *args):
+    """
+    Run password hashing `function` on the password executor
+
+    :raises SERVER_BUSY: if the queue is full
+    """
+    with _PasswordQueue.lock:
+        if _PasswordQueue.depth >= PASSWORD_HASH_QUEUE_SIZE:
+            _PasswordQueue.rejected += 1
+            raise SERVER_BUSY
+        _PasswordQueue.depth += 1
+    try:
+        return await asyncio.wrap_future(password_executor.submit(function, *args))
+    finally:
+        with _PasswordQueue.lock:
+            _PasswordQueue.depth -= 1
+
 
 def verify_password(plain_password, hashed_password):
     """
@@ -24,6 +103,15 @@ def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
 
+def verify_and_update_password(plain_password, hashed_password):
+    """
+    Verify plain password against hashed
+
+    Returns (valid, new_hash), `new_hash` if the hash has to be updated to current settings
+    """
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
 def get_password_hash(password):
     """
     Create hashed password
@@ -45,10 +133,59 @@ def create_access_token(user_id):
 def decode_token(token):
     """
     Decode subject from JWT Token
+
+    Claims of verified tokens are cached until the token expires
     """
+    digest = _token_digest(token)
+    # Checked before the cache, a revocation may race with caching of the token
+    if digest in revoked_tokens:
+        return None
+
+    claims = token_cache.get(digest)
+    if claims is not None:
+        user_id, expire = claims
+        if expire > time.time():
+            return user_id
+        token_cache.pop(digest)
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id = payload.get("sub")
-        return user_id
     except JWTError:
         return None
+
+    expire = payload.get("exp")
+    if user_id is not None and _is_timestamp(expire):
+        token_cache.set(digest, (user_id, expire), ttl=expire - time.time())
+    return user_id
+
+
+def revoke_token(token):
+    """
+    Revocation hook, evict token from cache and reject it until it expires
+    """
+    try:
+        expire = jwt.get_unverified_claims(token).get("exp")
+    except JWTError:
+        return
+    # Tokens with an invalid exp are rejected by decode anyway
+    if expire is not None and not _is_timestamp(expire):
+        return
+
+    digest = _token_digest(token)
+    revoked_tokens.add(digest, ttl=expire - time.time() if expire is not None else None)
+    token_cache.pop(digest)
+
+
+def _is_timestamp(value):
+    """
+    Whether claim `value` is a numeric timestamp
+    """
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _token_digest(token):
+    """
+    Key of token in caches
+    """
+    return hashlib.sha256(token.encode("utf-8")).digest()
@@ -1,6 +1,12 @@
 """
 Test fixtures
 """
+from os import environ
+
+# TestClient runs each request on a new event loop, asyncpg connections can't be reused across them
+environ.setdefault("DATABASE_ASYNC_POOL_SIZE", "0")
+
+# pylint: disable=wrong-import-position
 import pytest
 from app.auth.utils import create_access_token
 
@@ -3,14 +3,27 @@ Utility functions for Crypto Functionality like
 RSA encryption, decryption, signature verification, etc.
 """
 from datetime import datetime, timedelta
+import base64
+from functools import lru_cache
+import hashlib
+import json
 import logging
-from cryptography.hazmat.primitives.asymmetric import rsa
+import os
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
 from cryptography.hazmat.primitives import serialization
 from cryptography import x509
 from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.x509.oid import NameOID
 
-from app.settings import RSA_SECRET_KEY, SERVER_RSA_KEY_SIZE, USER_RSA_KEY_SIZE
+from app.crypto_utils.enums import SignatureSchemes
+from app.settings import (
+    BALANCE_TOKEN_SCHEME,
+    RSA_SECRET_KEY,
+    SERVER_RSA_KEY_SIZE,
+    USER_RSA_KEY_SIZE
+)
 
 
 class ServerKeys:
@@ -20,21 +33,125 @@ class ServerKeys:
     public_key = None
     private_key = None
 
+    # Keys signing balance tokens, same as the keys above for rsa
+    balance_scheme = SignatureSchemes.RSA
+    balance_public_key = None
+    balance_private_key = None
+
+    # Fingerprints of the public keys above
+    key_id = None
+    balance_key_id = None
+
+    # {representation: (body, etag)} of the keys above, served by the key endpoints
+    published_keys = {}
+
     @classmethod
     def serialized_public_key(cls):
         """To be shared to all users"""
         return serialize_public_key(cls.public_key)
 
+    @classmethod
+    def serialized_balance_public_key(cls):
+        """To be shared to all users for verifying balance tokens"""
+        return serialize_public_key(cls.balance_public_key)
+
 def serialize_private_key(key):
     """
     Serialize private key encrypted with `RSA_SECRET`
     """
+    # Ed25519 keys have no traditional format
+    if isinstance(key, ed25519.Ed25519PrivateKey):
+        private_format = serialization.PrivateFormat.PKCS8
+    else:
+        private_format = serialization.PrivateFormat.TraditionalOpenSSL
     return key.private_bytes(
         encoding=serialization.Encoding.PEM,
-        format=serialization.PrivateFormat.TraditionalOpenSSL,
+        format=private_format,
         encryption_algorithm=serialization.BestAvailableEncryption(RSA_SECRET_KEY)
     )
 
+# Envelope of private keys stored for users:
+# header | nonce | data key encrypted with key encryption key | nonce | key encrypted with data key
+# Both are authenticated with the header and the SHA-256 of the public key stored with the key,
+# so an envelope can't be moved to another key row
+ENVELOPE_HEADER = b"XPENV1"
+_NONCE_SIZE = 12
+_WRAPPED_KEY_SIZE = 32 + 16
+
+
+@lru_cache(maxsize=None)
+def _key_encryption_key():
+    """
+    AES-GCM key wrapping data keys of private keys, derived from `RSA_SECRET_KEY`
+    """
+    return AESGCM(HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=None,
+        info=b"xpay private key encryption",
+    ).derive(RSA_SECRET_KEY))
+
+
+def _envelope_aad(public_key):
+    """
+    Associated data of the envelope of the private key of serialized `public_key`
+    """
+    return ENVELOPE_HEADER + hashlib.sha256(public_key).digest()
+
+
+def encrypt_private_key(key):
+    """
+    Serialize private key of user and encrypt it with a new data key for storage
+
+    The envelope is bound to the serialized public key of `key`
+    """
+    private_bytes = key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.TraditionalOpenSSL,
+        encryption_algorithm=serialization.NoEncryption()
+    )
+    aad = _envelope_aad(serialize_public_key(key.public_key()))
+    data_key = AESGCM.generate_key(bit_length=256)
+    key_nonce, data_nonce = os.urandom(_NONCE_SIZE), os.urandom(_NONCE_SIZE)
+    return b"".join((
+        ENVELOPE_HEADER,
+        key_nonce,
+        _key_encryption_key().encrypt(key_nonce, data_key, aad),
+        data_nonce,
+        AESGCM(data_key).encrypt(data_nonce, private_bytes, aad),
+    ))
+
+
+def is_encrypted_envelope(key_bytes):
+    """
+    Whether stored private key is encrypted by `encrypt_private_key`
+    """
+    return bytes(key_bytes[:len(ENVELOPE_HEADER)]) == ENVELOPE_HEADER
+
+
+def _open_envelope(key_bytes, public_key):
+    """
+    Decrypt stored private key encrypted by `encrypt_private_key` to PEM,
+    `public_key` is the serialized public key stored with it
+
+    :raises cryptography.exceptions.InvalidTag: if the envelope was modified or moved
+    :raises ValueError: if `public_key` is missing
+    """
+    if public_key is None:
+        raise ValueError("Public key of the envelope is required")
+    aad = _envelope_aad(public_key)
+    key_bytes = memoryview(key_bytes)
+    start = len(ENVELOPE_HEADER)
+    key_nonce = key_bytes[start:start + _NONCE_SIZE]
+    start += _NONCE_SIZE
+    wrapped_key = key_bytes[start:start + _WRAPPED_KEY_SIZE]
+    start += _WRAPPED_KEY_SIZE
+    data_nonce = key_bytes[start:start + _NONCE_SIZE]
+    start += _NONCE_SIZE
+    data_key = _key_encryption_key().decrypt(bytes(key_nonce), bytes(wrapped_key), aad)
+    return AESGCM(data_key).decrypt(bytes(data_nonce), bytes(key_bytes[start:]), aad)
+
+
 def serialize_public_key(key):
     """
     Serialize public key
@@ -44,28 +161,78 @@ def serialize_public_key(key):
         format=serialization.PublicFormat.SubjectPublicKeyInfo
     )
 
+CERTIFICATE_SUBJECT = x509.Name([
+    x509.NameAttribute(NameOID.COUNTRY_NAME, "IN"),
+    x509.NameAttribute(NameOID.STATE_OR_PROVINCE_NAME, "Kerala"),
+    x509.NameAttribute(NameOID.LOCALITY_NAME, "Kochi"),
+    x509.NameAttribute(NameOID.ORGANIZATION_NAME, "Users"),
+    x509.NameAttribute(NameOID.COMMON_NAME, "User"),
+])
+
+CERTIFICATE_ISSUER = x509.Name([
+    x509.NameAttribute(NameOID.COUNTRY_NAME, "IN"),
+    x509.NameAttribute(NameOID.STATE_OR_PROVINCE_NAME, "Kerala"),
+    x509.NameAttribute(NameOID.LOCALITY_NAME, "Kochi"),
+    x509.NameAttribute(NameOID.ORGANIZATION_NAME, "XPay"),
+    x509.NameAttribute(NameOID.COMMON_NAME, "xpay.com")
+])
+
+
+def _base64url(data):
+    """
+    Unpadded base64url encoding used by JWK
+    """
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _base64url_int(value):
+    """
+    Unpadded base64url encoding of big endian unsigned integer
+    """
+    return _base64url(value.to_bytes((value.bit_length() + 7) // 8 or 1, "big"))
+
+
+def create_key_id(public_key):
+    """
+    Stable id of public key, the SHA-256 fingerprint of its SubjectPublicKeyInfo
+    """
+    digest = hashes.Hash(hashes.SHA256())
+    digest.update(public_key.public_bytes(
+        encoding=serialization.Encoding.DER,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo
+    ))
+    return _base64url(digest.finalize())
+
+
+def public_key_jwk(public_key, kid):
+    """
+    JSON Web Key of public key
+    """
+    if isinstance(public_key, ed25519.Ed25519PublicKey):
+        raw = public_key.public_bytes(
+            encoding=serialization.Encoding.Raw,
+            format=serialization.PublicFormat.Raw
+        )
+        return {"kty": "OKP", "crv": "Ed25519", "alg": "EdDSA", "use": "sig", "kid": kid,
+                "x": _base64url(raw)}
+    if isinstance(public_key, ec.EllipticCurvePublicKey):
+        numbers = public_key.public_numbers()
+        return {"kty": "EC", "crv": "P-256", "alg": "ES256", "use": "sig", "kid": kid,
+                "x": _base64url(numbers.x.to_bytes(32, "big")),
+                "y": _base64url(numbers.y.to_bytes(32, "big"))}
+    numbers = public_key.public_numbers()
+    return {"kty": "RSA", "alg": "RS256", "use": "sig", "kid": kid,
+            "n": _base64url_int(numbers.n), "e": _base64url_int(numbers.e)}
+
+
 def create_pub_key_certificate(pub_key):
     """
     Create x.509 certificate of a user key issued by server
     """
-    subject = x509.Name([
-        x509.NameAttribute(NameOID.COUNTRY_NAME, "IN"),
-        x509.NameAttribute(NameOID.STATE_OR_PROVINCE_NAME, "Kerala"),
-        x509.NameAttribute(NameOID.LOCALITY_NAME, "Kochi"),
-        x509.NameAttribute(NameOID.ORGANIZATION_NAME, "Users"),
-        x509.NameAttribute(NameOID.COMMON_NAME, "User"),
-    ])
-    issuer = x509.Name([
-        x509.NameAttribute(NameOID.COUNTRY_NAME, "IN"),
-        x509.NameAttribute(NameOID.STATE_OR_PROVINCE_NAME, "Kerala"),
-        x509.NameAttribute(NameOID.LOCALITY_NAME, "Kochi"),
-        x509.NameAttribute(NameOID.ORGANIZATION_NAME, "XPay"),
-        x509.NameAttribute(NameOID.COMMON_NAME, "xpay.com")
-    ])
     one_day = timedelta(1, 0, 0)
     builder = x509.CertificateBuilder()
-    builder = builder.subject_name(subject)
-    builder = builder.issuer_name(issuer)
+    builder = builder.subject_name(CERTIFICATE_SUBJECT)
+    builder = builder.issuer_name(CERTIFICATE_ISSUER)
     builder = builder.not_valid_before(datetime.today() - one_day)
     builder = builder.not_valid_after(datetime.today() + (one_day * 30))
     builder = builder.serial_number(x509.random_serial_number())
@@ -101,7 +268,7 @@ def create_user_key_pair():
     Create a key pair for the user
     """
     private_key = create_private_key()
-    private_bytes = serialize_private_key(private_key)
+    private_bytes = encrypt_private_key(private_key)
     public_bytes = serialize_public_key(private_key.public_key())
     return private_bytes, public_bytes
 
@@ -113,17 +280,26 @@ def deserialize_public_key(key_bytes):
     return serialization.load_pem_public_key(key_bytes)
 
 
-def deserialize_private_key(key_bytes):
+def deserialize_private_key(key_bytes, public_key=None):
     """
     Deserialize private key from storage
+
+    `public_key` stored with the key is required for keys encrypted by `encrypt_private_key`
     """
+    if is_encrypted_envelope(key_bytes):
+        return serialization.load_pem_private_key(_open_envelope(key_bytes, public_key), None)
     return serialization.load_pem_private_key(key_bytes, RSA_SECRET_KEY)
 
 
-def decrypt_private_key(key):
+def decrypt_private_key(key, public_key=None):
     """
     Decrypt private key stored in db to hand it over to user
+
+    Keys encrypted by `encrypt_private_key` are stored in the format handed over,
+    `public_key` stored with the key is required for them
     """
+    if is_encrypted_envelope(key):
+        return _open_envelope(key, public_key)
     private_key = serialization.load_pem_private_key(key, RSA_SECRET_KEY)
     return private_key.private_bytes(
         encoding=serialization.Encoding.PEM,
@@ -132,14 +308,22 @@ def decrypt_private_key(key):
     )
 
 
-def create_server_keys(filename):
+def create_signing_key(scheme):
+    """
+    Create a private key for signature `scheme`
+    """
+    if scheme == SignatureSchemes.ED25519:
+        return ed25519.Ed25519PrivateKey.generate()
+    if scheme == SignatureSchemes.ECDSA_P256:
+        return ec.generate_private_key(ec.SECP256R1())
+    return create_private_key()
+
+
+def create_server_keys(filename, scheme=SignatureSchemes.RSA):
     """
     Create a key pair and store in file for the server
     """
-    private_key = rsa.generate_private_key(
-        public_exponent=65537,
-        key_size=SERVER_RSA_KEY_SIZE
-    )
+    private_key = create_signing_key(scheme)
     public_key = private_key.public_key()
     private_bytes = serialize_private_key(private_key)
     public_bytes = serialize_public_key(public_key)
@@ -151,20 +335,87 @@ def create_server_keys(filename):
     return private_key, public_key
 
 
-def load_server_keys():
+def load_server_key_pair(filename, scheme=SignatureSchemes.RSA, create=True):
     """
-    Load a key pair from the filesystem
+    Load a key pair of `scheme` from the filesystem, created if missing and `create`
+
+    :raises FileNotFoundError, ValueError: if the key pair can't be loaded and not `create`
     """
-    filename = "server_key"
     try:
         with open(filename, "rb") as private_file:
             private_bytes = private_file.read()
         with open(filename + ".pub", "rb") as public_file:
             public_bytes = public_file.read()
-        ServerKeys.private_key = serialization.load_pem_private_key(private_bytes, RSA_SECRET_KEY)
-        ServerKeys.public_key = deserialize_public_key(public_bytes)
+        private_key = serialization.load_pem_private_key(private_bytes, RSA_SECRET_KEY)
+        public_key = deserialize_public_key(public_bytes)
         logging.info("Loaded server keys")
+        return private_key, public_key
 
     except (FileNotFoundError, ValueError) as exc:
+        if not create:
+            raise
         logging.info(exc)
-        ServerKeys.private_key, ServerKeys.public_key = create_server_keys(filename)
+        return create_server_keys(filename, scheme)
+
+
+def load_server_keys():
+    """
+    Load server key pairs from the filesystem
+    """
+    filename = "server_key"
+    ServerKeys.private_key, ServerKeys.public_key = load_server_key_pair(filename)
+
+    ServerKeys.balance_scheme = SignatureSchemes(BALANCE_TOKEN_SCHEME)
+    if ServerKeys.balance_scheme == SignatureSchemes.RSA:
+        ServerKeys.balance_private_key = ServerKeys.private_key
+        ServerKeys.balance_public_key = ServerKeys.public_key
+    else:
+        ServerKeys.balance_private_key, ServerKeys.balance_public_key = load_server_key_pair(
+            f"{filename}.{ServerKeys.balance_scheme.value}",
+            ServerKeys.balance_scheme
+        )
+
+    ServerKeys.key_id = create_key_id(ServerKeys.public_key)
+    ServerKeys.balance_key_id = create_key_id(ServerKeys.balance_public_key)
+
+    publish_server_keys()
+
+
+def _published_body(representation):
+    """
+    Response body of server keys in `representation`, one of "text", "json" or "jwks"
+    """
+    if representation == "text":
+        return base64.b64encode(ServerKeys.serialized_public_key())
+    if representation == "json":
+        return json.dumps({
+            "keys": [
+                {
+                    "use": "sig",
+                    "scheme": SignatureSchemes.RSA.value,
+                    "kid": ServerKeys.key_id,
+                    "key": base64.b64encode(ServerKeys.serialized_public_key()).decode(),
+                },
+                {
+                    "use": "balance",
+                    "scheme": ServerKeys.balance_scheme.value,
+                    "kid": ServerKeys.balance_key_id,
+                    "key": base64.b64encode(ServerKeys.serialized_balance_public_key()).decode(),
+                },
+            ]
+        }).encode()
+    keys = [public_key_jwk(ServerKeys.public_key, ServerKeys.key_id)]
+    if ServerKeys.balance_key_id != ServerKeys.key_id:
+        keys.append(public_key_jwk(ServerKeys.balance_public_key, ServerKeys.balance_key_id))
+    return json.dumps({"keys": keys}).encode()
+
+
+def publish_server_keys():
+    """
+    Build response bodies and ETags of the loaded server keys, served until keys are reloaded
+    """
+    published_keys = {}
+    for representation in ("text", "json", "jwks"):
+        body = _published_body(representation)
+        published_keys[representation] = (body, f'"{hashlib.sha256(body).hexdigest()[:32]}"')
+    ServerKeys.published_keys = published_keys
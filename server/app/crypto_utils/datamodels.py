@@ -5,12 +5,10 @@ import base64
 from typing import Optional
 from pydantic import BaseModel, validator
 from app.crypto_utils import (
-    create_private_key,
     create_pub_key_certificate,
     create_user_key_pair,
     decrypt_private_key,
-    serialize_private_key,
-    serialize_public_key
+    deserialize_public_key
 )
 from app.crypto_utils.encryption_provider import EncryptionProvider
 
@@ -25,11 +23,15 @@ class UserKeys(BaseModel):
 
     @validator("private_key")
     # pylint: disable=fixme,unused-argument
-    def decrypt_key(cls, value, **kwargs):
+    def decrypt_key(cls, value, values, **kwargs):
         """
-        Decrypt and enccode private key for user
+        Decrypt and enccode private key for user, with the public key encoded before it
         """
-        return base64.b64encode(decrypt_private_key(value))
+        public_key = values.get("public_key")
+        return base64.b64encode(decrypt_private_key(
+            value,
+            base64.b64decode(public_key) if public_key else None
+        ))
 
     @validator("public_key", "certificate")
     # pylint: disable=fixme,unused-argument
@@ -45,8 +47,10 @@ class UserKeys(BaseModel):
     # pylint: disable=fixme,unused-argument
     def create_public_key_signature(cls, value, values, **kwargs):
         """
-        Create public key signature for user
+        Create public key signature for user, unless stored with the key
         """
+        if value:
+            return base64.b64encode(value)
         return base64.b64encode(
             EncryptionProvider.sign(
                 base64.b64decode(values.get("public_key"))
@@ -57,7 +61,14 @@ class UserKeys(BaseModel):
         """
         Create a key pair for the user and return as `UserKeys` object
         """
-        private_key, public_key = create_user_key_pair()
+        return cls.from_key_pair(create_user_key_pair())
+
+    @classmethod
+    def from_key_pair(cls, key_pair):
+        """
+        Create `UserKeys` object from serialized (private_key, public_key)
+        """
+        private_key, public_key = key_pair
         keys = cls(private_key=private_key, public_key=public_key)
         return cls.validate(keys)
 
@@ -66,13 +77,18 @@ class UserKeys(BaseModel):
         """
         Create a certificate for the keypair and return as `UserKeys` object
         """
-        private_key = create_private_key()
-        public_key = private_key.public_key()
-        public_cert = create_pub_key_certificate(public_key)
+        return cls.from_cert_key_pair(create_user_key_pair())
+
+    @classmethod
+    def from_cert_key_pair(cls, key_pair):
+        """
+        Create `UserKeys` object with certificate from serialized (private_key, public_key)
+        """
+        private_key, public_key = key_pair
         keys = cls(
-            private_key=serialize_private_key(private_key),
-            public_key=serialize_public_key(public_key),
-            certificate=public_cert
+            private_key=private_key,
+            public_key=public_key,
+            certificate=create_pub_key_certificate(deserialize_public_key(public_key))
         )
         return cls.validate(keys)
 
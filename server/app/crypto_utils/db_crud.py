@@ -1,16 +1,21 @@
 """
 DB layer for crypto_utils
 """
-from app.crypto_utils import create_user_key_pair
 from app.crypto_utils.db_models import Key
+from app.crypto_utils.key_pool import user_key_pool
 
 
 def db_create_user_key_pair(database, user, commit=False):
     """
     Create a key pair for the user
     """
-    private_key, public_key = create_user_key_pair()
-    key = Key(user=user, public_key=public_key, private_key=private_key)
+    private_key, public_key, public_key_signature = user_key_pool.take()
+    key = Key(
+        user=user,
+        public_key=public_key,
+        private_key=private_key,
+        public_key_signature=public_key_signature
+    )
     database.add(key)
     if commit:
         database.commit()
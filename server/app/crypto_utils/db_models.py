@@ -2,7 +2,7 @@
 Database models for keys
 """
 from sqlalchemy import Column, String, DateTime, ForeignKey, func, Enum, Integer, LargeBinary
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import deferred, relationship
 
 from app.database.connection import Base
 from app.crypto_utils.enums import KeyStatus
@@ -17,7 +17,9 @@ class Key(Base):
     id = Column("id", Integer, primary_key=True)
     user_id = Column("user_id", String, ForeignKey("users.id"), nullable=False)
     public_key = Column("public_key", LargeBinary, nullable=False)
-    private_key = Column("private_key", LargeBinary, nullable=False)
+    # Only handed over with the user profile, loaded on access otherwise
+    private_key = deferred(Column("private_key", LargeBinary, nullable=False))
+    public_key_signature = Column("public_key_signature", LargeBinary, nullable=False)
     created_at = Column("created_at", DateTime, nullable=False, server_default=func.now())
     status = Column("status", Enum(KeyStatus), nullable=False, default=KeyStatus.ACTIVE)
 
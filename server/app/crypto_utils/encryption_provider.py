@@ -2,7 +2,7 @@
 Encryption provider class used for signing and verifying
 """
 from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, padding
 from cryptography.exceptions import InvalidSignature
 
 from app.crypto_utils import ServerKeys
@@ -15,9 +15,15 @@ class EncryptionProvider:
     def sign(cls, data, private_key=None):
         """
         Sign a message
+
+        PKCS1v15 for rsa keys, the native schemes of ed25519 and ecdsa keys
         """
         if private_key is None:
             private_key = ServerKeys.private_key
+        if isinstance(private_key, ed25519.Ed25519PrivateKey):
+            return private_key.sign(data)
+        if isinstance(private_key, ec.EllipticCurvePrivateKey):
+            return private_key.sign(data, ec.ECDSA(hashes.SHA256()))
         return private_key.sign(
             data,
             padding.PKCS1v15(),
@@ -33,12 +39,17 @@ class EncryptionProvider:
         if public_key is None:
             public_key = ServerKeys.public_key
         try:
-            public_key.verify(
-                signature,
-                data,
-                padding.PKCS1v15(),
-                hashes.SHA256()
-            )
+            if isinstance(public_key, ed25519.Ed25519PublicKey):
+                public_key.verify(signature, data)
+            elif isinstance(public_key, ec.EllipticCurvePublicKey):
+                public_key.verify(signature, data, ec.ECDSA(hashes.SHA256()))
+            else:
+                public_key.verify(
+                    signature,
+                    data,
+                    padding.PKCS1v15(),
+                    hashes.SHA256()
+                )
             return True
         except InvalidSignature:
             return False
@@ -1,28 +1,60 @@
 """
 Routers for crypto_utils
 """
-import base64
-from fastapi import Response, Depends
+from fastapi import Depends, Query, Request, Response
 from fastapi.routing import APIRouter
 from app.auth.policies import get_current_user
 from app.crypto_utils import ServerKeys
 from app.crypto_utils.datamodels import UserKeys
+from app.crypto_utils.key_pool import cert_key_pool
+from app.settings import MAX_CERTIFICATE_BATCH_SIZE, SERVER_KEY_MAX_AGE
 
 router = APIRouter(
     prefix=""
 )
 
+def _keys_response(request, representation, media_type):
+    """
+    Cacheable response of server keys, 304 if the client has the current version
+    """
+    body, etag = ServerKeys.published_keys[representation]
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={SERVER_KEY_MAX_AGE}",
+        "Vary": "Accept",
+    }
+    client_etags = {
+        tag.strip()[2:] if tag.strip().startswith("W/") else tag.strip()
+        for tag in request.headers.get("If-None-Match", "").split(",")
+    }
+    if etag in client_etags or "*" in client_etags:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type=media_type, headers=headers)
+
+
 @router.get("/key")
-def get_server_public_key():
+def get_server_public_key(request: Request):
     """
     GET /key
 
     GET the server public key
+
+    With `Accept: application/json`, GET the rsa key and the key signing balance tokens
+    """
+    if "application/json" in request.headers.get("Accept", ""):
+        return _keys_response(request, "json", "application/json")
+    return _keys_response(request, "text", "text/plain")
+
+
+@router.get("/.well-known/jwks.json")
+def get_server_jwks(request: Request):
     """
-    return Response(
-        content=base64.b64encode(ServerKeys.serialized_public_key()),
-        media_type="text/plain"
-    )
+    GET /.well-known/jwks.json
+
+    GET all valid server public keys as a JSON Web Key Set
+    """
+    return _keys_response(request, "jwks", "application/json")
+
 
 @router.get("/key/generate/ledger-integrity-pair", dependencies=[Depends(get_current_user)])
 def generate_ledger_integrity_keypair():
@@ -31,4 +63,16 @@ def generate_ledger_integrity_keypair():
 
     Generate a keypair for ensuring ledger integrity
     """
-    return UserKeys.create_cert()
+    return UserKeys.from_cert_key_pair(cert_key_pool.take())
+
+
+@router.get("/key/generate/ledger-integrity-pairs", dependencies=[Depends(get_current_user)])
+def generate_ledger_integrity_keypairs(
+    count: int = Query(..., ge=1, le=MAX_CERTIFICATE_BATCH_SIZE)
+):
+    """
+    GET /key/generate/ledger-integrity-pairs?count=N
+
+    Generate `count` keypairs for ensuring ledger integrity
+    """
+    return [UserKeys.from_cert_key_pair(key_pair) for key_pair in cert_key_pool.take_many(count)]
@@ -13,3 +13,12 @@ class KeyStatus(str, Enum):
     DEPRECATED = "DEPRECATED"
     DISABLED = "DISABLED"
     DELETED = "DELETED"
+
+
+class SignatureSchemes(str, Enum):
+    """
+    Signature schemes of server keys
+    """
+    RSA = "rsa"
+    ED25519 = "ed25519"
+    ECDSA_P256 = "ecdsa-p256"
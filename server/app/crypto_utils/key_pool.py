@@ -0,0 +1,187 @@
+"""
+Pools of pre-generated keys, refilled in background processes
+"""
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import multiprocessing
+import threading
+import time
+
+from app.crypto_utils import create_user_key_pair
+from app.crypto_utils.datamodels import UserKeys
+from app.crypto_utils.encryption_provider import EncryptionProvider
+from app.metrics import register_metrics
+from app.settings import KEY_POOL_SIZE, KEY_POOL_WORKERS
+
+# Window in seconds over which refill rate is measured
+REFILL_RATE_WINDOW = 60
+
+
+class KeyPool:
+    """
+    Bounded pool of ready to use keys
+
+    `factory` generates a key in a worker process, so it has to be picklable.
+    `prepare`, if given, finishes the generated key in the server process.
+    """
+    # pylint: disable=too-many-instance-attributes
+    pools = []
+    _executor = None
+
+    def __init__(self, name, factory, size, prepare=None):
+        self.name = name
+        self.factory = factory
+        self.prepare = prepare
+        self.size = size
+        self._keys = deque()
+        self._refills = deque()
+        self._pending = 0
+        self._lock = threading.Lock()
+        self.taken = 0
+        self.fallbacks = 0
+        self.refilled = 0
+        KeyPool.pools.append(self)
+        register_metrics(f"key_pool.{name}", self.metrics)
+
+    def generate(self):
+        """
+        Generate a key synchronously
+        """
+        key = self.factory()
+        return self.prepare(key) if self.prepare else key
+
+    def take(self):
+        """
+        Claim a key from the pool, generated synchronously if the pool is empty
+        """
+        try:
+            key = self._keys.popleft()
+            self._count(taken=1)
+        except IndexError:
+            self._count(fallbacks=1)
+            key = self.generate()
+        self.refill()
+        return key
+
+    def take_many(self, count):
+        """
+        Claim `count` keys from the pool, missing keys are generated synchronously
+        """
+        keys = []
+        while len(keys) < count:
+            try:
+                keys.append(self._keys.popleft())
+            except IndexError:
+                break
+        missing = count - len(keys)
+        self._count(taken=len(keys), fallbacks=missing)
+        keys.extend(self.generate() for _ in range(missing))
+        self.refill()
+        return keys
+
+    def _count(self, taken=0, fallbacks=0):
+        """
+        Count keys taken from the pool and generated on request
+        """
+        with self._lock:
+            self.taken += taken
+            self.fallbacks += fallbacks
+
+    def refill(self):
+        """
+        Schedule generation of missing keys
+        """
+        executor = KeyPool._executor
+        if executor is None:
+            return
+        with self._lock:
+            missing = self.size - len(self._keys) - self._pending
+            if missing <= 0:
+                return
+            self._pending += missing
+        try:
+            for _ in range(missing):
+                executor.submit(self.factory).add_done_callback(self._on_generated)
+        except RuntimeError:
+            # Executor shut down
+            with self._lock:
+                self._pending = 0
+
+    def _on_generated(self, future):
+        """
+        Add a key generated in the background to the pool
+        """
+        with self._lock:
+            self._pending -= 1
+        try:
+            key = future.result()
+            if self.prepare:
+                key = self.prepare(key)
+        # pylint: disable=broad-except
+        except Exception:
+            logging.exception("Key generation for %s pool failed", self.name)
+            return
+        with self._lock:
+            self._keys.append(key)
+            self.refilled += 1
+            self._refills.append(time.monotonic())
+
+    def metrics(self):
+        """
+        Depth and refill rate (keys per second) of the pool
+        """
+        window_start = time.monotonic() - REFILL_RATE_WINDOW
+        with self._lock:
+            while self._refills and self._refills[0] < window_start:
+                self._refills.popleft()
+            return {
+                "size": self.size,
+                "depth": len(self._keys),
+                "pending": self._pending,
+                "taken": self.taken,
+                "fallbacks": self.fallbacks,
+                "refilled": self.refilled,
+                "refill_rate": len(self._refills) / REFILL_RATE_WINDOW,
+            }
+
+    @classmethod
+    def start(cls):
+        """
+        Start the worker processes and fill all pools
+        """
+        if KEY_POOL_WORKERS <= 0:
+            return
+        cls._executor = ProcessPoolExecutor(
+            max_workers=KEY_POOL_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+        for pool in cls.pools:
+            pool.refill()
+
+    @classmethod
+    def stop(cls):
+        """
+        Stop the worker processes
+        """
+        executor, cls._executor = cls._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+def sign_user_key_pair(key_pair):
+    """
+    Add server signature of the public key to serialized (private_key, public_key)
+    """
+    private_key, public_key = key_pair
+    return private_key, public_key, EncryptionProvider.sign(public_key)
+
+
+user_key_pool = KeyPool("user_keys", create_user_key_pair, KEY_POOL_SIZE, sign_user_key_pair)
+
+ledger_key_pool = KeyPool(
+    "ledger_keys", create_user_key_pair, KEY_POOL_SIZE, UserKeys.from_key_pair
+)
+
+# Certificates are issued on take, so their validity starts at issuance
+cert_key_pool = KeyPool("cert_keys", create_user_key_pair, KEY_POOL_SIZE)
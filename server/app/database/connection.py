@@ -1,34 +1,161 @@
 """
 Database connection utils
 """
+import logging
 from os import environ
 
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm.session import sessionmaker
+from sqlalchemy.pool import NullPool
+from starlette.concurrency import run_in_threadpool
+
+from app.database.pool import PoolMetrics
+from app.metrics import register_metrics
+from app.settings import (
+    DATABASE_ASYNC_POOL_SIZE,
+    DATABASE_MAX_OVERFLOW,
+    DATABASE_POOL_PRE_PING,
+    DATABASE_POOL_RECYCLE,
+    DATABASE_POOL_SIZE,
+    DATABASE_POOL_TIMEOUT,
+    DATABASE_STATEMENT_TIMEOUT
+)
+
+
+def get_database_url(env_variable="DATABASE_URL", driver=None):
+    """
+    Get SQLAlchemy url of db from environment, with `driver` if given
+    """
+    database_url = environ.get(env_variable)
+
+    if database_url is None:
+        return None
+
+    scheme = f"postgresql+{driver}://" if driver else "postgresql://"
+    for prefix in ("postgres://", "postgresql://"):
+        if database_url.startswith(prefix):
+            return database_url.replace(prefix, scheme, 1)
+    return database_url
+
+
+def _async_pool_share():
+    """
+    Size and overflow of DATABASE_POOL_SIZE and DATABASE_MAX_OVERFLOW given to asyncio sessions
+
+    Blocking and asyncio sessions share one budget of connections per process
+    """
+    if not DATABASE_ASYNC_POOL_SIZE or not DATABASE_POOL_SIZE:
+        return 0, 0
+    return (
+        DATABASE_ASYNC_POOL_SIZE,
+        DATABASE_MAX_OVERFLOW * DATABASE_ASYNC_POOL_SIZE // DATABASE_POOL_SIZE
+    )
+
+
+def _pool_options(pool_size, max_overflow, connect_args):
+    """
+    Engine options for a pool configured from settings
+
+    A `pool_size` of 0 disables pooling
+    """
+    connect_args = connect_args if DATABASE_STATEMENT_TIMEOUT else {}
+    if not pool_size:
+        return {"poolclass": NullPool, "connect_args": connect_args}
+
+    return {
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": DATABASE_POOL_TIMEOUT,
+        "pool_recycle": DATABASE_POOL_RECYCLE,
+        "pool_pre_ping": DATABASE_POOL_PRE_PING,
+        "connect_args": connect_args,
+    }
 
 
 def set_up_database(env_variable="DATABASE_URL"):
     """Set up connection to a db"""
-    database_url = environ.get(env_variable)
+    database_url = get_database_url(env_variable)
+
+    if database_url is None:
+        return None
+
+    async_pool_size, async_max_overflow = _async_pool_share()
+    return create_engine(
+        database_url,
+        **_pool_options(
+            DATABASE_POOL_SIZE - async_pool_size,
+            max(DATABASE_MAX_OVERFLOW - async_max_overflow, 0),
+            {"options": f"-c statement_timeout={DATABASE_STATEMENT_TIMEOUT}"}
+        )
+    )
+
+
+def set_up_async_database(env_variable="DATABASE_URL"):
+    """
+    Set up asyncio connection to a db
+
+    Returns None if asyncpg is not installed. Pooled connections belong to the event loop
+    they were opened on, set DATABASE_ASYNC_POOL_SIZE to 0 where each request runs its own loop
+    """
+    database_url = get_database_url(env_variable, "asyncpg")
 
     if database_url is None:
         return None
 
-    if database_url.startswith("postgres://"):
-        database_url = database_url.replace("postgres://", "postgresql://", 1)
+    try:
+        return create_async_engine(
+            database_url,
+            **_pool_options(
+                *_async_pool_share(),
+                {"server_settings": {"statement_timeout": str(DATABASE_STATEMENT_TIMEOUT)}}
+            )
+        )
+    except ImportError:
+        logging.warning("asyncpg is not installed, asyncio sessions are disabled")
+        return None
+
 
-    return create_engine(database_url)
+async def run_db(database, function, *args):
+    """
+    Run blocking CRUD `function(database, *args)` from an async endpoint
+
+    Runs on the connection of an asyncio session, else in the threadpool.
+    Only database work should be done in `function`, it runs on the event loop
+    with asyncio sessions. Prepare values in the threadpool before calling.
+    """
+    if isinstance(database, AsyncSession):
+        return await database.run_sync(function, *args)
+    return await run_in_threadpool(function, database, *args)
 
 
 def verify_postgres():
     """
     Connects to postgres database and raises exception if failed
     """
-    engine = set_up_database()
-    engine.connect()
+    with engine.connect():
+        pass
 
 
 Base = declarative_base()
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=set_up_database())
+engine = set_up_database()
+
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+_async_engine = set_up_async_database()
+
+if engine is not None:
+    register_metrics("database_pool", PoolMetrics(engine.pool).collect)
+
+if _async_engine is not None and DATABASE_ASYNC_POOL_SIZE:
+    register_metrics("async_database_pool", PoolMetrics(_async_engine.sync_engine.pool).collect)
+
+AsyncSessionLocal = sessionmaker(
+    autocommit=False,
+    autoflush=False,
+    expire_on_commit=False,
+    class_=AsyncSession,
+    bind=_async_engine
+) if _async_engine is not None else None
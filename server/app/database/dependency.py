@@ -1,15 +1,47 @@
 """
 Database dependencies
 """
-from app.database.connection import SessionLocal
+from fastapi import Request
 
+from app.database.connection import AsyncSessionLocal, SessionLocal
 
-def get_db():
+
+def get_request_db(request: Request):
+    """
+    Get database session of request, opened on first access
+
+    Shared by middleware, policies and controllers, closed by `close_request_db`
+    """
+    if getattr(request.state, "database", None) is None:
+        request.state.database = SessionLocal()
+    return request.state.database
+
+
+def close_request_db(request: Request):
     """
-    Dependency to inject database session to controller
+    Close database session of request if it was opened
     """
-    database = SessionLocal()
-    try:
-        yield database
-    finally:
+    database = getattr(request.state, "database", None)
+    if database is not None:
+        request.state.database = None
         database.close()
+
+
+def get_db(request: Request):
+    """
+    Dependency to inject database session of request to controller
+    """
+    return get_request_db(request)
+
+
+async def get_async_db(request: Request):
+    """
+    Dependency to inject asyncio database session to async controller
+
+    Injects the blocking session of request if asyncio sessions are disabled, use with `run_db`
+    """
+    if AsyncSessionLocal is None:
+        yield get_request_db(request)
+    else:
+        async with AsyncSessionLocal() as database:
+            yield database
@@ -0,0 +1,84 @@
+"""
+Connection pool metrics for sizing
+"""
+from threading import Lock
+import time
+
+from sqlalchemy import event
+
+
+class PoolMetrics:
+    """
+    Usage of a QueuePool, recorded through the public pool events
+
+    Checkouts are timed around `pool.connect`, the wait includes
+    timed out checkouts, pre pings and opening new connections
+    """
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, pool):
+        self.pool = pool
+        self._lock = Lock()
+        self.checkouts = 0
+        self.connections = 0
+        self.overflow_connections = 0
+        self.max_in_use = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self._connect = pool.connect
+        pool.connect = self._timed_connect
+        event.listen(pool, "connect", self._connected)
+        event.listen(pool, "checkout", self._checked_out)
+
+    def _timed_connect(self):
+        """
+        Check out a connection, recording how long the caller waited for it
+        """
+        start = time.perf_counter()
+        try:
+            return self._connect()
+        finally:
+            waited = time.perf_counter() - start
+            with self._lock:
+                self.waits += 1
+                self.wait_seconds += waited
+                self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+    # pylint: disable=unused-argument
+    def _connected(self, dbapi_connection, connection_record):
+        """
+        Count new connection, an overflow connection if the pool was full
+        """
+        with self._lock:
+            self.connections += 1
+            # overflow counts up from -pool_size and is incremented before connecting
+            if self.pool.overflow() > 0:
+                self.overflow_connections += 1
+
+    # pylint: disable=unused-argument
+    def _checked_out(self, dbapi_connection, connection_record, connection_proxy):
+        """
+        Count successful checkout
+        """
+        with self._lock:
+            self.checkouts += 1
+            self.max_in_use = max(self.max_in_use, self.pool.checkedout())
+
+    def collect(self):
+        """
+        Current usage of the pool
+        """
+        with self._lock:
+            return {
+                "size": self.pool.size(),
+                "in_use": self.pool.checkedout(),
+                "idle": self.pool.checkedin(),
+                "overflow": max(self.pool.overflow(), 0),
+                "max_in_use": self.max_in_use,
+                "checkouts": self.checkouts,
+                "connections": self.connections,
+                "overflow_connections": self.overflow_connections,
+                "checkout_waits": self.waits,
+                "checkout_wait_seconds": self.wait_seconds,
+                "max_checkout_wait_seconds": self.max_wait_seconds,
+            }
@@ -0,0 +1,33 @@
+"""
+Tests for connection pool metrics
+"""
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+from app.database.pool import PoolMetrics
+
+
+def test_pool_checkout_wait():
+    """
+    Test checkouts are counted and timed, including timed out checkouts
+    """
+    engine = create_engine(
+        "sqlite://", poolclass=QueuePool, pool_size=1, max_overflow=0, pool_timeout=0.1
+    )
+    metrics = PoolMetrics(engine.pool)
+
+    with engine.connect():
+        collected = metrics.collect()
+        assert collected["in_use"] == 1
+        assert collected["checkout_waits"] == 1
+        with pytest.raises(PoolTimeoutError):
+            engine.connect()
+
+    collected = metrics.collect()
+    assert collected["checkouts"] == 1
+    assert collected["checkout_waits"] == 2
+    assert collected["max_checkout_wait_seconds"] >= 0.1
+    assert collected["checkout_wait_seconds"] >= collected["max_checkout_wait_seconds"]
+    engine.dispose()
@@ -12,3 +12,13 @@ NOT_AUTHENTICATED = HTTPException(
     status_code=401,
     detail="Not authenticated"
 )
+
+LEDGER_MODIFIED = HTTPException(
+    status_code=403,
+    detail="Ledger has been modified by unauthorized entities"
+)
+
+SERVER_BUSY = HTTPException(
+    status_code=503,
+    detail="Server busy, try again later"
+)
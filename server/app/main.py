@@ -1,21 +1,30 @@
 """
 Entrypoint for the server
 """
-from fastapi import FastAPI, Request
+from fastapi import Depends, FastAPI, Request
 
 from starlette.middleware.cors import CORSMiddleware
 
+from app.auth.policies import metrics_access
 from app.crypto_utils import load_server_keys
+from app.crypto_utils.key_pool import KeyPool
 from app.database.connection import verify_postgres
+from app.metrics import collect_metrics
 from app.middleware import inject_user_to_request
 from app.auth.endpoints import router as auth_router
 from app.payments.endpoints import router as payments_router
+from app.payments.utils import NEXT_CURSOR_HEADER
+from app.payments.tasks import start_balance_checkpoints, stop_balance_checkpoints
 from app.crypto_utils.endpoints import router as crypto_router
 
 app = FastAPI()
 
 app.add_event_handler("startup", verify_postgres)
 app.add_event_handler("startup", load_server_keys)
+app.add_event_handler("startup", start_balance_checkpoints)
+app.add_event_handler("startup", KeyPool.start)
+app.add_event_handler("shutdown", stop_balance_checkpoints)
+app.add_event_handler("shutdown", KeyPool.stop)
 app.include_router(auth_router)
 app.include_router(payments_router)
 app.include_router(crypto_router)
@@ -26,6 +35,7 @@ app.add_middleware(
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=[NEXT_CURSOR_HEADER],
     )
 
 @app.middleware("http")
@@ -39,3 +49,9 @@ async def inject_user(request: Request, call_next):
 def hello_world():
     """Hello World Entrypoint"""
     return "Hello"
+
+
+@app.get("/metrics", dependencies=[Depends(metrics_access)])
+def metrics():
+    """In process metrics of the server, for holders of `METRICS_TOKEN`"""
+    return collect_metrics()
@@ -0,0 +1,19 @@
+"""
+In process metrics of the application
+"""
+
+_collectors = {}
+
+
+def register_metrics(name, collector):
+    """
+    Register `collector`, a callable returning a dict of current metrics, as `name`
+    """
+    _collectors[name] = collector
+
+
+def collect_metrics():
+    """
+    Collect metrics from all registered collectors
+    """
+    return {name: collector() for name, collector in _collectors.items()}
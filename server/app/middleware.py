@@ -2,29 +2,49 @@
 Middleware for the application
 """
 from fastapi import Request
+from starlette.concurrency import run_in_threadpool
+from app.auth.cache import user_cache
+from app.auth.datamodels import UserSnapshot
 from app.auth.db_crud import db_get_user_by_id
 
-from app.database.connection import SessionLocal
+from app.database.dependency import close_request_db, get_request_db
 from app.auth.utils import decode_token
 
 
 async def inject_user_to_request(request: Request, call_next):
     """
-    Inject user if authenticated to request
+    Inject id of user if authenticated to request
+
+    The user itself is only loaded from db when asked for by `get_request_user`.
+    Closes the database session of request once the response is ready.
     """
     try:
         token = request.headers.get("Authorization", "").split(" ")[1]
-        user_id = decode_token(token)
-        if user_id is None:
-            request.state.user = None
-        else:
-            try:
-                database = SessionLocal()
-                request.state.user = db_get_user_by_id(database, user_id)
-            finally:
-                database.close()
-
+        request.state.user_id = decode_token(token)
     except IndexError:
-        request.state.user = None
+        request.state.user_id = None
+
+    try:
+        return await call_next(request)
+    finally:
+        # Returning the connection to the pool rolls back on the db, off the event loop
+        await run_in_threadpool(close_request_db, request)
+
+
+def get_request_user(request: Request):
+    """
+    Get snapshot of authenticated user of request
+
+    Loaded from cache, or the db session of request on a miss, on first access
+    """
+    if not hasattr(request.state, "user"):
+        user_id = request.state.user_id
+        user = user_cache.get(user_id) if user_id is not None else None
+        if user is None and user_id is not None:
+            user_in_db = db_get_user_by_id(get_request_db(request), user_id, "auth")
+            if user_in_db is not None:
+                user = UserSnapshot.from_user(user_in_db)
+                user_cache.set(user_id, user)
+        request.state.user = user
 
-    return await call_next(request)
+    return request.state.user
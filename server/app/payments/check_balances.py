@@ -0,0 +1,38 @@
+"""
+Consistency check of maintained balances against transaction history
+
+Pass `--rebuild` to correct inconsistent balances, after balances were not maintained
+"""
+import logging
+import sys
+
+# Models related to users have to be mapped before querying them
+# pylint: disable=unused-import
+from app.crypto_utils import db_models
+from app.database.connection import SessionLocal
+from app.payments.db_crud import db_check_balances, db_rebuild_balances
+
+
+def main(rebuild = False):
+    """
+    Checker entrypoint, exits with non zero status if any balance is inconsistent
+
+    Inconsistent balances are corrected if `rebuild`
+    """
+    with SessionLocal() as session:
+        if rebuild:
+            user_ids = db_rebuild_balances(session)
+            logging.info("%d balances rebuilt", len(user_ids))
+        mismatches = db_check_balances(session)
+
+    for user_id, (balance, recalculated_balance) in mismatches.items():
+        logging.error(
+            "Balance of %s is %s, recalculated as %s", user_id, balance, recalculated_balance
+        )
+    logging.info("%d inconsistent balances found", len(mismatches))
+    return len(mismatches)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(1 if main("--rebuild" in sys.argv[1:]) else 0)
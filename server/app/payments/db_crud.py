@@ -1,34 +1,301 @@
 """
 Database functions of payments
 """
-from app.payments.db_models import Transaction
+from collections import defaultdict
+from datetime import timezone
+import logging
+
+from sqlalchemy import case, func, or_, select, text, tuple_, union_all
+from sqlalchemy.dialects.postgresql import insert
+
+from app.auth.db_models import User
+from app.crypto_utils.encryption_provider import EncryptionProvider
+from app.payments.db_models import Balance, BalanceCheckpoint, Transaction
 from app.payments.enums import RequestStates, TransactionTypes
+from app.settings import MAINTAIN_BALANCES, OFFLINE_INSERT_BATCH_SIZE
+from app.utils import invalidate_balance_tokens
+
+# Balances are stored as floats, differences below a paisa are rounding noise
+BALANCE_TOLERANCE = 0.005
 
 
 def db_calculate_balance(database, user_id):
+    """
+    Get balance of user
+
+    Read from the maintained balances table, or from the latest checkpoint
+    and the transactions after it if balances are not maintained
+    """
+    if not MAINTAIN_BALANCES:
+        checkpoint = db_get_latest_balance_checkpoint(database, user_id)
+        return db_recalculate_balance(database, user_id, checkpoint)
+
+    balance = database.query(Balance.amount).filter(Balance.user_id == user_id).scalar()
+
+    return balance if balance is not None else 0
+
+
+def db_recalculate_balance(database, user_id, checkpoint = None, until = None):
     """
     Calculate balance from transaction history
+
+    Only transactions after `checkpoint` and upto the position `until`
+    ((created_at, id) of a transaction) are aggregated if given
+
+    Aggregated in a single query, both sides of a self transfer cancel out
     """
-    transactions = database.query(Transaction).filter(
+    query = database.query(
+        func.sum(
+            case((Transaction.receiver_id == user_id, Transaction.amount), else_=0)
+            - case((Transaction.sender_id == user_id, Transaction.amount), else_=0)
+        )
+    ).filter(
         (Transaction.sender_id == user_id)
         | (Transaction.receiver_id == user_id)
-    ).filter(Transaction.type != TransactionTypes.REQUEST).all()
+    ).filter(Transaction.type != TransactionTypes.REQUEST)
+
+    if checkpoint is not None:
+        query = query.filter(_transaction_position() > tuple_(
+            checkpoint.as_of_timestamp, checkpoint.last_transaction_id
+        ))
+
+    if until is not None:
+        query = query.filter(_transaction_position() <= tuple_(*until))
+
+    balance = query.scalar() or 0
+
+    return balance + checkpoint.balance if checkpoint is not None else balance
+
+
+def db_update_balances(database, transactions):
+    """
+    Apply `transactions` to the balances of the users involved
+
+    Has to be called in the same db transaction that creates `transactions`
+    """
+    deltas = defaultdict(float)
+    for transaction in transactions:
+        if transaction.type == TransactionTypes.REQUEST:
+            continue
+        deltas[transaction.receiver_id] += transaction.amount
+        if transaction.sender_id is not None:
+            deltas[transaction.sender_id] -= transaction.amount
+
+    if not deltas or not MAINTAIN_BALANCES:
+        return
+
+    # Sorted to lock balance rows in the same order across concurrent transactions
+    statement = insert(Balance).values([
+        {"user_id": user_id, "amount": deltas[user_id]}
+        for user_id in sorted(deltas)
+    ])
+    statement = statement.on_conflict_do_update(
+        index_elements=[Balance.user_id],
+        set_={"amount": Balance.amount + statement.excluded.amount}
+    )
+    # Users or transactions pending in session have to be written first
+    database.flush()
+    database.execute(statement)
+
 
-    recieved = sum((
-        transaction.amount
-        for transaction in transactions
-        if user_id == transaction.receiver_id
-    ))
+def db_check_balances(database, user_ids = None):
+    """
+    Compare maintained balances against a full recalculation from transaction history
+
+    Returns {user_id: (balance, recalculated_balance)} for every mismatch
+    """
+    entries = _balance_entries()
+    recalculated = select(
+        entries.c.user_id,
+        func.sum(entries.c.amount).label("amount")
+    ).group_by(entries.c.user_id).subquery()
+
+    query = database.query(
+        User.id,
+        func.coalesce(Balance.amount, 0),
+        func.coalesce(recalculated.c.amount, 0)
+    ).outerjoin(Balance, Balance.user_id == User.id)\
+        .outerjoin(recalculated, recalculated.c.user_id == User.id)
+
+    if user_ids is not None:
+        query = query.filter(User.id.in_(user_ids))
+
+    return {
+        user_id: (balance, recalculated_balance)
+        for user_id, balance, recalculated_balance in query.all()
+        if abs(balance - recalculated_balance) >= BALANCE_TOLERANCE
+    }
+
+
+def db_rebuild_balances(database, commit = True):
+    """
+    Recalculate maintained balances from transaction history, for when balances
+    were not maintained for a while
+
+    Concurrent balance updates wait until the rebuild is committed
+
+    Returns ids of users whose balance was corrected
+    """
+    database.execute(text(f"LOCK TABLE {Balance.__tablename__} IN EXCLUSIVE MODE"))
+    entries = _balance_entries()
+    statement = insert(Balance).from_select(
+        ["user_id", "amount"],
+        select(entries.c.user_id, func.sum(entries.c.amount)).group_by(entries.c.user_id)
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=[Balance.user_id],
+        set_={"amount": statement.excluded.amount},
+        where=func.abs(Balance.amount - statement.excluded.amount) >= BALANCE_TOLERANCE
+    ).returning(Balance.user_id)
+    user_ids = [user_id for (user_id,) in database.execute(statement).all()]
+    invalidate_balance_tokens(user_ids)
+    if commit:
+        database.commit()
 
-    sent = sum((
-        transaction.amount
-        for transaction in transactions
-        if user_id == transaction.sender_id
-    ))
+    return user_ids
 
-    balance = recieved - sent
 
-    return balance
+def db_get_latest_balance_checkpoint(database, user_id):
+    """
+    Select the most recent balance checkpoint of user with a valid server signature
+
+    Checkpoints with invalid signatures are logged and skipped
+    """
+    query = database.query(BalanceCheckpoint)\
+        .filter(BalanceCheckpoint.user_id == user_id)\
+        .order_by(
+            BalanceCheckpoint.as_of_timestamp.desc(),
+            BalanceCheckpoint.last_transaction_id.desc()
+        )
+    checkpoint = query.first()
+    while checkpoint is not None and not EncryptionProvider.verify(
+        balance_checkpoint_data(
+            checkpoint.user_id,
+            checkpoint.balance,
+            checkpoint.as_of_timestamp,
+            checkpoint.last_transaction_id
+        ),
+        checkpoint.signature
+    ):
+        logging.error("Balance checkpoint %s has an invalid signature", checkpoint.id)
+        checkpoint = query.filter(
+            tuple_(BalanceCheckpoint.as_of_timestamp, BalanceCheckpoint.last_transaction_id)
+            < tuple_(checkpoint.as_of_timestamp, checkpoint.last_transaction_id)
+        ).first()
+    return checkpoint
+
+
+def db_create_balance_checkpoints(database, delta_size, settled_before = None, commit = True):
+    """
+    Create a checkpoint for every user with atleast `delta_size` transactions
+    since their latest checkpoint
+
+    Transactions created after `settled_before` are left for the next run,
+    so that transactions still being committed are not skipped over
+
+    Returns the number of checkpoints created
+    """
+    latest = select(
+        BalanceCheckpoint.user_id,
+        BalanceCheckpoint.as_of_timestamp,
+        BalanceCheckpoint.last_transaction_id
+    ).distinct(BalanceCheckpoint.user_id).order_by(
+        BalanceCheckpoint.user_id,
+        BalanceCheckpoint.as_of_timestamp.desc(),
+        BalanceCheckpoint.last_transaction_id.desc()
+    ).subquery()
+    entries = _balance_entries()
+
+    candidates = select(entries.c.user_id)\
+        .outerjoin(latest, latest.c.user_id == entries.c.user_id)\
+        .where(or_(
+            latest.c.user_id.is_(None),
+            tuple_(entries.c.created_at, entries.c.id)
+            > tuple_(latest.c.as_of_timestamp, latest.c.last_transaction_id)
+        ))\
+        .group_by(entries.c.user_id)\
+        .having(func.count() >= delta_size)
+
+    if settled_before is not None:
+        candidates = candidates.where(entries.c.created_at < settled_before)
+
+    count = 0
+    for (user_id,) in database.execute(candidates).all():
+        checkpoint = db_get_latest_balance_checkpoint(database, user_id)
+        query = database.query(Transaction.created_at, Transaction.id).filter(
+            (Transaction.sender_id == user_id)
+            | (Transaction.receiver_id == user_id)
+        ).filter(Transaction.type != TransactionTypes.REQUEST)
+
+        if checkpoint is not None:
+            query = query.filter(_transaction_position() > tuple_(
+                checkpoint.as_of_timestamp, checkpoint.last_transaction_id
+            ))
+        if settled_before is not None:
+            query = query.filter(Transaction.created_at < settled_before)
+
+        last_position = query.order_by(
+            Transaction.created_at.desc(),
+            Transaction.id.desc()
+        ).first()
+        if last_position is None:
+            continue
+
+        balance = db_recalculate_balance(database, user_id, checkpoint, last_position)
+        as_of_timestamp, last_transaction_id = last_position
+        database.add(BalanceCheckpoint(
+            user_id=user_id,
+            balance=balance,
+            as_of_timestamp=as_of_timestamp,
+            last_transaction_id=last_transaction_id,
+            signature=EncryptionProvider.sign(balance_checkpoint_data(
+                user_id, balance, as_of_timestamp, last_transaction_id
+            ))
+        ))
+        count += 1
+
+    if commit:
+        database.commit()
+
+    return count
+
+
+def balance_checkpoint_data(user_id, balance, as_of_timestamp, last_transaction_id):
+    """
+    Data signed by the server for a balance checkpoint
+    """
+    return f"{user_id}{float(balance):.2f}{as_of_timestamp.isoformat()}{last_transaction_id}"\
+        .encode("utf-8")
+
+
+def _transaction_position():
+    """
+    Position of a transaction in the order of insertion
+    """
+    return tuple_(Transaction.created_at, Transaction.id)
+
+
+def _balance_entries():
+    """
+    Subquery of balance changes, each transaction as a credit to receiver and debit to sender
+    """
+    return union_all(
+        select(
+            Transaction.receiver_id.label("user_id"),
+            Transaction.amount.label("amount"),
+            Transaction.created_at,
+            Transaction.id
+        ).where(Transaction.type != TransactionTypes.REQUEST),
+        select(
+            Transaction.sender_id.label("user_id"),
+            (-Transaction.amount).label("amount"),
+            Transaction.created_at,
+            Transaction.id
+        ).where(
+            Transaction.type != TransactionTypes.REQUEST,
+            Transaction.sender_id.isnot(None)
+        )
+    ).subquery()
 
 
 def db_get_transaction_by_id(database, transaction_id):
@@ -78,6 +345,8 @@ def db_create_transaction(database, data, current_user_id, commit=True):
         transaction.request_state = RequestStates.PENDING
 
     database.add(transaction)
+    db_update_balances(database, [transaction])
+    invalidate_balance_tokens((transaction.sender_id, transaction.receiver_id))
     if commit:
         database.commit()
         database.refresh(transaction)
@@ -85,35 +354,111 @@ def db_create_transaction(database, data, current_user_id, commit=True):
     return transaction
 
 
-def db_create_offline_transaction(database, data, commit = False):
+def offline_transaction_rows(transactions):
     """
-    Create an offline transaction record
+    Column values of offline transactions, to be inserted by `db_create_offline_transactions`
+
+    Timestamps are stored as naive UTC, asyncpg doesn't convert aware datetimes
     """
-    database.add(Transaction(is_offline=True, **data.dict()))
+    rows = []
+    for transaction in transactions:
+        row = transaction.dict()
+        if row["timestamp"].tzinfo is not None:
+            row["timestamp"] = row["timestamp"].astimezone(timezone.utc).replace(tzinfo=None)
+        row["is_offline"] = True
+        rows.append(row)
+    return rows
+
+
+def db_create_offline_transactions(database, rows, commit = False):
+    """
+    Create offline transaction records from `offline_transaction_rows`,
+    skipping the already synced ones
+
+    Rows are inserted in batches of OFFLINE_INSERT_BATCH_SIZE
+
+    Returns ids of the created transactions
+    """
+    created = []
+    for start in range(0, len(rows), OFFLINE_INSERT_BATCH_SIZE):
+        statement = insert(Transaction).values(
+            rows[start:start + OFFLINE_INSERT_BATCH_SIZE]
+        ).on_conflict_do_nothing(
+            index_elements=[Transaction.id]
+        ).returning(
+            Transaction.id,
+            Transaction.type,
+            Transaction.sender_id,
+            Transaction.receiver_id,
+            Transaction.amount
+        )
+        created.extend(database.execute(statement).all())
+
+    if not created:
+        return []
+
+    db_update_balances(database, created)
+    invalidate_balance_tokens({
+        user_id
+        for transaction in created
+        for user_id in (transaction.sender_id, transaction.receiver_id)
+    })
     if commit:
         database.commit()
 
+    return [transaction.id for transaction in created]
 
-def db_list_transactions(database, transaction_ids = None, user_id = None, limit = 0, offset = 0):
-    """
-    List all transactions
+
+def db_list_transactions(
+    database,
+    transaction_ids = None,
+    user_id = None,
+    limit = 0,
+    offset = 0,
+    cursor = None
+):
     """
+    List all transactions, latest first
 
+    `cursor` is the (timestamp, id) of the last transaction of the previous page,
+    `offset` is the page number and is ignored if `cursor` is given
+    """
+    # pylint: disable=too-many-arguments
     query = database.query(Transaction)
 
-    if user_id:
+    if transaction_ids:
+        query = query.filter(Transaction.id.in_(transaction_ids))
+
+    if cursor is not None:
         query = query.filter(
-            (Transaction.sender_id == user_id)
-            | (Transaction.receiver_id == user_id)
+            tuple_(Transaction.timestamp, Transaction.id) < tuple_(*cursor)
         )
+        offset = 0
 
-    if transaction_ids:
-        query = query.filter(Transaction.id.in_(transaction_ids))
+    if user_id:
+        # Each side walks its own (user, timestamp, id) index in order,
+        # so a page costs the same however long the user's history is
+        sent = query.filter(Transaction.sender_id == user_id)
+        received = query.filter(
+            Transaction.receiver_id == user_id,
+            or_(Transaction.sender_id.is_(None), Transaction.sender_id != user_id)
+        )
+        if limit:
+            sent = _latest_first(sent).limit(limit * (offset + 1))
+            received = _latest_first(received).limit(limit * (offset + 1))
+        query = sent.union_all(received)
 
-    query = query.order_by(Transaction.timestamp.desc())
+    query = _latest_first(query)
 
     if limit:
         query = query.limit(limit)
     query = query.offset(limit*offset)
 
     return query.all()
+
+
+def _latest_first(query):
+    """
+    Order transactions query by latest first
+    """
+    return query.order_by(Transaction.timestamp.desc(), Transaction.id.desc())
@@ -1,7 +1,17 @@
 """
 DB Models for payments
 """
-from sqlalchemy import Column, Enum, Float, ForeignKey, String, DateTime, func
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Enum,
+    Float,
+    ForeignKey,
+    Integer,
+    LargeBinary,
+    String,
+    func
+)
 
 from app.database.connection import Base
 from app.payments.enums import RequestStates, TransactionTypes
@@ -22,3 +32,35 @@ class Transaction(Base):
     timestamp = Column("timestamp", DateTime, nullable=False, server_default=func.now())
     request_state = Column("request_state", Enum(RequestStates), nullable=True)
     is_offline = Column("is_offline", nullable=False, default=False)
+    # Time of insertion, `timestamp` of offline transactions is set by the client
+    created_at = Column("created_at", DateTime, nullable=False, server_default=func.now())
+
+
+class Balance(Base):
+    """
+    Mapper class for balances table
+
+    Running balance of every user, updated along with each transaction
+    """
+    __tablename__ = "balances"
+
+    user_id = Column("user_id", String, ForeignKey("users.id"), primary_key=True)
+    amount = Column("amount", Float, nullable=False, default=0)
+
+
+class BalanceCheckpoint(Base):
+    """
+    Mapper class for balance_checkpoints table
+
+    Signed balance of a user upto the transaction (as_of_timestamp, last_transaction_id)
+    in the order of insertion (created_at, id)
+    """
+    __tablename__ = "balance_checkpoints"
+
+    id = Column("id", Integer, primary_key=True)
+    user_id = Column("user_id", String, ForeignKey("users.id"), nullable=False)
+    balance = Column("balance", Float, nullable=False)
+    as_of_timestamp = Column("as_of_timestamp", DateTime, nullable=False)
+    last_transaction_id = Column("last_transaction_id", String, nullable=False)
+    signature = Column("signature", LargeBinary, nullable=False)
+    created_at = Column("created_at", DateTime, nullable=False, server_default=func.now())
@@ -4,37 +4,43 @@ Router for payments
 Prefix: /payments
 """
 
-import json
 import logging
 from typing import List, Union, Optional
-from fastapi import APIRouter, Depends, HTTPException, Request
-from pydantic import ValidationError
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from starlette.concurrency import run_in_threadpool
 
 from app.auth.policies import get_current_user
 from app.auth.db_crud import db_get_user_by_id, db_list_users
-from app.crypto_utils import deserialize_public_key
-from app.exceptions import PERMISSION_DENIED
+from app.crypto_utils.key_pool import ledger_key_pool
+from app.exceptions import LEDGER_MODIFIED, PERMISSION_DENIED
 from app.payments.datamodels import (
-    OfflineEncryptedTransaction,
     PaymentRequestResponse,
     Transaction,
     TransactionCreate
 )
 from app.payments.db_crud import (
     db_calculate_balance,
-    db_create_offline_transaction,
+    db_create_offline_transactions,
     db_create_transaction,
     db_get_transaction_by_id,
     db_has_pending_requests,
     db_list_transactions,
-    db_update_payment_request
+    db_update_payment_request,
+    offline_transaction_rows
 )
-from app.database.dependency import get_db
+from app.database.connection import run_db
+from app.database.dependency import get_async_db, get_db
 from app.payments.enums import RequestStates, TransactionTypes
-from app.crypto_utils.encryption_provider import EncryptionProvider
-from app.settings import SERVER_RSA_KEY_SIZE, USER_RSA_KEY_SIZE
-from app.utils import sign_balance
-from app.crypto_utils.datamodels import UserKeys
+from app.payments.utils import (
+    NEXT_CURSOR_HEADER,
+    decode_cursor,
+    encode_cursor,
+    LedgerTooLargeError,
+    LedgerVerifier,
+    parse_ledger
+)
+from app.settings import MAX_LEDGER_SIZE
+from app.utils import sign_user_balance
 
 router = APIRouter(
     prefix="/payments"
@@ -84,7 +90,7 @@ def create_payment(
             )
 
     if transaction.receiver_id is not None:
-        target_user = db_get_user_by_id(database, transaction.receiver_id)
+        target_user = db_get_user_by_id(database, transaction.receiver_id, "id")
         if target_user is None:
             raise HTTPException(
                 status_code=400,
@@ -104,79 +110,69 @@ def create_payment(
     new_balance = balance - transaction.amount if current_user.id == transaction.sender_id\
                 else balance + transaction.amount
     return {
-        **sign_balance(new_balance),
+        **sign_user_balance(current_user.id, new_balance),
         "transaction": transaction.dict(),
     }
 
 
 @router.get("", response_model=List[Transaction])
 def list_all_transactions(
+    response: Response,
     current_user = Depends(get_current_user),
     database = Depends(get_db),
     limit: Optional[int] = 0,
-    offset: Optional[int] = 0
+    offset: Optional[int] = 0,
+    cursor: Optional[str] = None
 ):
     """
     GET /payments
 
     List all transactions involving the authenticated user
+
+    Pass the `X-Next-Cursor` response header as `cursor` to get the next page
+
+    raises 400 if cursor is invalid
     """
-    return db_list_transactions(database, user_id=current_user.id, limit=limit, offset=offset)
+    # pylint: disable=too-many-arguments
+    try:
+        position = decode_cursor(cursor) if cursor is not None else None
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+
+    transactions = db_list_transactions(
+        database,
+        user_id=current_user.id,
+        limit=limit,
+        offset=offset,
+        cursor=position
+    )
+    if limit and len(transactions) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(transactions[-1])
+    return transactions
 
 
 @router.post("/offline", status_code=201)
 async def sync_offline_payments(
     request: Request,
-    database = Depends(get_db),
-    current_user = Depends(get_current_user)
+    database = Depends(get_async_db),
+    current_user = Depends(get_current_user),
+    new_keys: bool = False
 ):
     """
     POST /payments/offline
 
     Sync offline transactions
+
+    Pass `new_keys=true` once the client has run out of ledger integrity keys to be issued new ones
     """
-    ledger_modified_error = HTTPException(
-        status_code=403,
-        detail="Ledger has been modified by unauthorized entities"
-    )
     transactions = []
-    transaction_ids = []
     user_ids = set()
-    raw_transactions = await request.body()
+    verifier = LedgerVerifier()
     try:
-        user_signature_size = USER_RSA_KEY_SIZE // 8
-        server_signature_size = SERVER_RSA_KEY_SIZE // 8
-        public_key_trailer = b"-----END PUBLIC KEY-----\n"
-        ledger_seperator = b"-----LEDGER SERPERATOR-----\n"
-        for raw_transaction in raw_transactions.split(ledger_seperator):
-            signature = raw_transaction[:user_signature_size]
-            public_key_signature = raw_transaction[
-                user_signature_size
-                :user_signature_size + server_signature_size
-            ]
-
-            start_index = user_signature_size + server_signature_size
-            [public_key, raw_data] = raw_transaction[start_index:].split(public_key_trailer)
-            public_key += public_key_trailer
-            data = json.loads(raw_data)
-            transactions.append(
-                OfflineEncryptedTransaction(
-                    signature=signature,
-                    public_key=public_key,
-                    public_key_signature=public_key_signature,
-                    raw_data=raw_data,
-                    **data
-                )
-            )
-
-    except (json.JSONDecodeError, ValidationError, IndexError) as exc:
-        raise ledger_modified_error from exc
-
-    for transaction in transactions:
-        try:
+        async for transaction in parse_ledger(request.stream(), MAX_LEDGER_SIZE):
             # User has to be either receiver or sender
             if current_user.id not in (transaction.receiver_id, transaction.sender_id):
-                raise ledger_modified_error
+                raise LEDGER_MODIFIED
 
             if transaction.receiver_id == current_user.id:
                 user_ids.update({transaction.sender_id,})
@@ -184,46 +180,61 @@ async def sync_offline_payments(
                 user_ids.update({transaction.receiver_id,})
 
             # Public key cannot be user's
-            if current_user.keys.public_key == transaction.public_key:
-                raise ledger_modified_error
-
-            # Verify user public key integrity
-            if not EncryptionProvider.verify(
-                transaction.public_key,
-                transaction.public_key_signature
-            ):
-                raise ledger_modified_error
-
-            # Verify data integrity
-            if not EncryptionProvider.verify(
-                transaction.raw_data,
-                transaction.signature,
-                deserialize_public_key(transaction.public_key)
-            ):
-                raise ledger_modified_error
-            transaction_ids.append(transaction.id)
-        except ValueError as exc:
-            raise ledger_modified_error from exc
+            if current_user.public_key == transaction.public_key:
+                raise LEDGER_MODIFIED
+
+            # Verify user public key and data integrity while the rest is uploaded
+            verifier.add(transaction)
+            transactions.append(Transaction.from_offline_transaction(transaction))
+
+    except LedgerTooLargeError as exc:
+        verifier.cancel()
+        raise HTTPException(status_code=413, detail=str(exc)) from exc
+    except ValueError as exc:
+        verifier.cancel()
+        raise LEDGER_MODIFIED from exc
+    except HTTPException:
+        verifier.cancel()
+        raise
+
+    if not await verifier.verify():
+        raise LEDGER_MODIFIED
+
+    rows = await run_in_threadpool(offline_transaction_rows, transactions)
+    count, balance = await run_db(
+        database,
+        _save_offline_transactions,
+        current_user.id,
+        rows,
+        user_ids
+    )
+    response = {
+        "count": count,
+        **await run_in_threadpool(sign_user_balance, current_user.id, balance),
+    }
+    if new_keys:
+        ledger_integrity_keys = await run_in_threadpool(ledger_key_pool.take)
+        response["ledger_integrity_keys"] = ledger_integrity_keys.dict()
 
-    processed_transactions = [
-        transaction.id for transaction in
-        db_list_transactions(database, transaction_ids)
-    ]
-    users = db_list_users(database, user_ids)
+    return response
+
+
+def _save_offline_transactions(database, current_user_id, rows, user_ids):
+    """
+    Save rows of verified offline transactions that aren't already synced
+
+    Returns the count of new transactions and the balance of user
+    """
+    if not rows:
+        return 0, db_calculate_balance(database, current_user_id)
+
+    users = db_list_users(database, user_ids, "id")
 
     if len(users) != len(user_ids):
-        raise ledger_modified_error
-
-    new_transactions = list(filter(
-        lambda transaction: transaction.id not in processed_transactions, transactions
-    ))
-    logging.debug([transaction.id for transaction in new_transactions])
-    for transaction in new_transactions:
-        db_create_offline_transaction(database, Transaction.from_offline_transaction(transaction))
+        raise LEDGER_MODIFIED
+
+    created_ids = db_create_offline_transactions(database, rows)
+    logging.debug(created_ids)
     database.commit()
 
-    return {
-        "count": len(new_transactions),
-        **sign_balance(db_calculate_balance(database, current_user.id)),
-        "ledger_integrity_keys": UserKeys.create_key_pair().dict()
-    }
+    return len(created_ids), db_calculate_balance(database, current_user_id)
@@ -0,0 +1,103 @@
+"""
+Background tasks of payments
+"""
+import asyncio
+from datetime import timedelta
+import logging
+
+from sqlalchemy import column, func, select, table
+from starlette.concurrency import run_in_threadpool
+
+from app.database.connection import SessionLocal
+from app.payments.db_crud import db_create_balance_checkpoints
+from app.settings import (
+    BALANCE_CHECKPOINT_DELTA_SIZE,
+    BALANCE_CHECKPOINT_INTERVAL,
+    BALANCE_CHECKPOINT_SETTLE_TIME,
+    MAINTAIN_BALANCES
+)
+
+# Advisory lock so that only one worker writes checkpoints at a time
+CHECKPOINT_LOCK_ID = 0x58504159
+
+_pg_stat_activity = table(
+    "pg_stat_activity",
+    column("pid"),
+    column("datname"),
+    column("xact_start")
+)
+
+
+class _CheckpointJob:
+    """
+    Running balance checkpoint job
+    """
+    task = None
+
+
+def _settled_before():
+    """
+    Creation time before which all transactions are committed
+
+    `created_at` is the start of the inserting db transaction, so transactions of
+    db transactions still open can have any `created_at` after their start
+    """
+    oldest_open = select(func.min(_pg_stat_activity.c.xact_start)).where(
+        _pg_stat_activity.c.pid != func.pg_backend_pid(),
+        _pg_stat_activity.c.datname == func.current_database()
+    ).scalar_subquery()
+    # least ignores NULL, if no other db transaction is open
+    return func.least(
+        func.now() - timedelta(seconds=BALANCE_CHECKPOINT_SETTLE_TIME),
+        oldest_open
+    )
+
+
+def create_balance_checkpoints():
+    """
+    Checkpoint balances of users whose transactions since last checkpoint exceed the delta size
+    """
+    database = SessionLocal()
+    try:
+        if not database.execute(select(func.pg_try_advisory_xact_lock(CHECKPOINT_LOCK_ID)))\
+                .scalar():
+            return 0
+        count = db_create_balance_checkpoints(
+            database,
+            BALANCE_CHECKPOINT_DELTA_SIZE,
+            database.execute(select(_settled_before())).scalar()
+        )
+        logging.info("Created %d balance checkpoints", count)
+        return count
+    finally:
+        database.close()
+
+
+async def run_balance_checkpoints():
+    """
+    Create balance checkpoints every `BALANCE_CHECKPOINT_INTERVAL` seconds until cancelled
+    """
+    while True:
+        await asyncio.sleep(BALANCE_CHECKPOINT_INTERVAL)
+        try:
+            await run_in_threadpool(create_balance_checkpoints)
+        # pylint: disable=broad-except
+        except Exception:
+            logging.exception("Balance checkpoint run failed")
+
+
+def start_balance_checkpoints():
+    """
+    Start the balance checkpoint job if balances are calculated from checkpoints, unless disabled
+    """
+    if BALANCE_CHECKPOINT_INTERVAL > 0 and not MAINTAIN_BALANCES:
+        _CheckpointJob.task = asyncio.ensure_future(run_balance_checkpoints())
+
+
+def stop_balance_checkpoints():
+    """
+    Stop the balance checkpoint job
+    """
+    if _CheckpointJob.task is not None:
+        _CheckpointJob.task.cancel()
+        _CheckpointJob.task = None
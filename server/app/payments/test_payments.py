@@ -1,27 +1,39 @@
 """
 Tests for payments
 """
+import asyncio
 from datetime import datetime
 import json
 from random import sample, choice
 
 from fastapi.testclient import TestClient
 from faker import Faker
+import pytest
+from sqlalchemy import func, select
 
 from app.auth.utils import create_access_token
 from app.conftest import get_auth_header
 from app.crypto_utils import deserialize_private_key, load_server_keys
 from app.crypto_utils.encryption_provider import EncryptionProvider
+from app.database.connection import SessionLocal
 from app.database.seed import create_users
 from app.main import app
 from app.payments.db_crud import (
     db_calculate_balance,
+    db_check_balances,
+    db_create_balance_checkpoints,
     db_create_transaction,
-    db_get_transaction_by_id
+    db_get_latest_balance_checkpoint,
+    db_get_transaction_by_id,
+    db_rebuild_balances,
+    db_recalculate_balance
 )
+from app.payments.db_models import Balance
+from app.payments.tasks import _settled_before
 from app.payments.datamodels import PaymentRequestResponse, TransactionCreate
 from app.payments.enums import RequestStates, TransactionTypes
-from app.utils import uuid_to_string
+from app.payments.utils import LEDGER_SEPERATOR, LedgerTooLargeError, parse_ledger
+from app.utils import balance_token_cache, uuid_to_string, verify_balance_token
 
 
 client = TestClient(app)
@@ -196,6 +208,184 @@ def test_create_transaction(db_session):
         assert req.status_code == 400
 
 
+def test_list_transactions(db_session):
+    """
+    TEST GET /payments
+
+    Test cursor pagination against offset pagination
+    Test invalid cursor
+    """
+    url = "/payments"
+    users = create_users(db_session)
+    user = users[0]
+
+    for _ in range(7):
+        data = TransactionCreate(
+            receiver_id=choice(users[1:]).id,
+            amount=fake.random_int(min=1, max=100),
+            type=TransactionTypes.REQUEST
+        )
+        db_create_transaction(db_session, data, choice([user, choice(users[1:])]).id, False)
+    db_session.commit()
+
+    req = client.get(url, headers=get_auth_header(user))
+    assert req.status_code == 200
+    all_ids = [transaction["id"] for transaction in req.json()]
+
+    cursor_ids = []
+    params = {"limit": 3}
+    while True:
+        req = client.get(url, params=params, headers=get_auth_header(user))
+        assert req.status_code == 200
+        cursor_ids += [transaction["id"] for transaction in req.json()]
+        if "X-Next-Cursor" not in req.headers:
+            break
+        params["cursor"] = req.headers["X-Next-Cursor"]
+
+    offset_ids = []
+    for page in range(3):
+        req = client.get(url, params={"limit": 3, "offset": page}, headers=get_auth_header(user))
+        offset_ids += [transaction["id"] for transaction in req.json()]
+
+    assert cursor_ids == all_ids
+    assert offset_ids == all_ids
+
+    req = client.get(url, params={"cursor": "invalid"}, headers=get_auth_header(user))
+    assert req.status_code == 400
+
+
+def test_balance_consistency(db_session):
+    """
+    Test maintained balances against recalculation from transaction history
+    """
+    users = create_users(db_session)
+
+    for user in users:
+        data = TransactionCreate(
+            amount=fake.random_int(min=1000, max=10000),
+            type=TransactionTypes.RECHARGE
+        )
+        db_create_transaction(db_session, data, user.id, False)
+
+    for _ in range(10):
+        [sender, receiver] = sample(users, 2)
+        data = TransactionCreate(
+            receiver_id=receiver.id,
+            amount=fake.random_int(min=1, max=100),
+            type=choice([TransactionTypes.TRANSFER, TransactionTypes.REQUEST])
+        )
+        db_create_transaction(db_session, data, sender.id, False)
+    db_session.commit()
+
+    for user in users:
+        assert db_calculate_balance(db_session, user.id) == \
+            db_recalculate_balance(db_session, user.id)
+    assert db_check_balances(db_session, [user.id for user in users]) == {}
+
+
+def test_balance_token_cache(db_session):
+    """
+    Test balance tokens are reused until a transaction touches the user
+    """
+    user = create_users(db_session, count=1)[0]
+    headers = get_auth_header(user)
+
+    first = client.get("/auth/me", headers=headers).json()["balance"]
+    second = client.get("/auth/me", headers=headers).json()["balance"]
+    assert first["signature"] == second["signature"]
+
+    data = TransactionCreate(amount=100, type=TransactionTypes.RECHARGE)
+    db_create_transaction(db_session, data, user.id)
+    assert balance_token_cache.get(user.id) is None
+
+    third = client.get("/auth/me", headers=headers).json()["balance"]
+    assert third["amount"] == first["amount"] + 100
+    assert third["signature"] != first["signature"]
+    assert verify_balance_token(third)
+
+
+def test_balance_checkpoints(db_session):
+    """
+    Test balance calculated from checkpoints against recalculation from transaction history
+    """
+    users = create_users(db_session)
+
+    def create_transfers(count):
+        for _ in range(count):
+            [sender, receiver] = sample(users, 2)
+            data = TransactionCreate(
+                receiver_id=receiver.id,
+                amount=fake.random_int(min=1, max=100),
+                type=TransactionTypes.TRANSFER
+            )
+            db_create_transaction(db_session, data, sender.id, False)
+        db_session.commit()
+
+    for user in users:
+        data = TransactionCreate(
+            amount=fake.random_int(min=1000, max=10000),
+            type=TransactionTypes.RECHARGE
+        )
+        db_create_transaction(db_session, data, user.id, False)
+    create_transfers(10)
+
+    assert db_create_balance_checkpoints(db_session, 1) >= len(users)
+    create_transfers(10)
+
+    for user in users:
+        checkpoint = db_get_latest_balance_checkpoint(db_session, user.id)
+        assert checkpoint is not None
+        assert db_recalculate_balance(db_session, user.id, checkpoint) == \
+            db_recalculate_balance(db_session, user.id)
+
+    # Checkpoints with invalid signatures are skipped
+    assert db_create_balance_checkpoints(db_session, 1) >= len(users)
+    user = users[0]
+    checkpoint = db_get_latest_balance_checkpoint(db_session, user.id)
+    checkpoint.balance += 1000
+    db_session.commit()
+    assert db_get_latest_balance_checkpoint(db_session, user.id).id != checkpoint.id
+    assert db_recalculate_balance(
+        db_session, user.id, db_get_latest_balance_checkpoint(db_session, user.id)
+    ) == db_recalculate_balance(db_session, user.id)
+
+
+def test_checkpoints_settled_before(db_session):
+    """
+    Test checkpoints don't pass the start of db transactions still open
+    """
+    other_session = SessionLocal()
+    try:
+        started = other_session.execute(select(func.now())).scalar()
+        settled_before = db_session.execute(select(_settled_before())).scalar()
+        assert settled_before <= started
+    finally:
+        other_session.close()
+
+
+def test_rebuild_balances(db_session):
+    """
+    Test rebuild of balances not maintained for a while
+    """
+    users = create_users(db_session)
+    for user in users:
+        data = TransactionCreate(
+            amount=fake.random_int(min=1000, max=10000),
+            type=TransactionTypes.RECHARGE
+        )
+        db_create_transaction(db_session, data, user.id, False)
+    db_session.commit()
+    user_ids = [user.id for user in users]
+
+    db_session.query(Balance).filter(Balance.user_id.in_(user_ids[:2]))\
+        .update({Balance.amount: 0}, synchronize_session=False)
+    db_session.commit()
+    assert len(db_check_balances(db_session, user_ids)) == 2
+
+    assert set(user_ids[:2]) <= set(db_rebuild_balances(db_session))
+    assert not db_check_balances(db_session, user_ids)
+
+
 def create_user_ledger_entry(user, data):
     """
     Creation of user's ledger
@@ -205,7 +395,7 @@ def create_user_ledger_entry(user, data):
     public_signature = EncryptionProvider.sign(public_bytes)
     data_signature = EncryptionProvider.sign(
         raw_data,
-        deserialize_private_key(user.keys.private_key)
+        deserialize_private_key(user.keys.private_key, user.keys.public_key)
     )
 
     return data_signature + public_signature + public_bytes + raw_data
@@ -271,3 +461,78 @@ def test_offline_payments(db_session):
         req = client.post(url, data=ledger, headers=headers)
         assert req.status_code == 201
         assert db_calculate_balance(db_session, user_id) == user_balances[user_id]
+
+
+def parse_chunks(chunks, max_size=10**7):
+    """
+    Parse offline transactions of ledger uploaded in `chunks`
+    """
+    async def stream():
+        for chunk in chunks:
+            yield chunk
+
+    async def parse():
+        return [transaction async for transaction in parse_ledger(stream(), max_size)]
+
+    return asyncio.run(parse())
+
+
+def split_chunks(ledger, size):
+    """
+    Split ledger in chunks of `size` bytes
+    """
+    return [ledger[start:start + size] for start in range(0, len(ledger), size)]
+
+
+def test_parse_ledger(db_session):
+    """
+    Test parsing of offline ledgers uploaded in chunks
+
+    Test entries and seperators split across chunks, truncated entries,
+    empty ledgers and the maximum size
+    """
+    users = create_users(db_session)
+    load_server_keys()
+    entries = [create_ledger_entry(users[0], users[1], amount)[0] for amount in (10, 20, 30)]
+    ledger = LEDGER_SEPERATOR.join(entries)
+
+    expected = parse_chunks([ledger])
+    assert [transaction.amount for transaction in expected] == [10, 20, 30]
+    assert expected[0].raw_data == entries[0][-len(expected[0].raw_data):]
+    for size in (1, 7, len(LEDGER_SEPERATOR) - 1, len(entries[0]) - 3, len(entries[0]) + 5):
+        assert parse_chunks(split_chunks(ledger, size)) == expected
+    assert parse_chunks([ledger + LEDGER_SEPERATOR]) == expected
+
+    for truncated in (ledger[:-5], ledger[:100], entries[0][:-5] + LEDGER_SEPERATOR + entries[1]):
+        with pytest.raises(ValueError):
+            parse_chunks(split_chunks(truncated, 64))
+
+    assert parse_chunks([]) == []
+    assert parse_chunks([b""]) == []
+
+    assert len(parse_chunks(split_chunks(ledger, 64), len(ledger))) == 3
+    with pytest.raises(LedgerTooLargeError):
+        parse_chunks(split_chunks(ledger, 64), len(ledger) - 1)
+
+
+def test_offline_payments_empty_ledger(db_session):
+    """
+    Test syncing an empty ledger creates no transactions
+    """
+    user = create_users(db_session)[0]
+    headers = get_auth_header(user)
+    headers["Content-Type"] = "application/octet-stream"
+    req = client.post("/payments/offline", data=b"", headers=headers)
+    assert req.status_code == 201
+    assert req.json()["count"] == 0
+    assert req.json()["amount"] == db_calculate_balance(db_session, user.id)
+    assert "ledger_integrity_keys" not in req.json()
+
+    # Keys are only issued when asked for
+    req = client.post("/payments/offline?new_keys=true", data=b"", headers=headers)
+    assert req.status_code == 201
+    keys = req.json()["ledger_integrity_keys"]
+    assert keys["public_key"] and keys["private_key"] and keys["public_key_signature"]
+
+    req = client.post("/payments/offline", data=b"x" * 10, headers=headers)
+    assert req.status_code == 403
@@ -0,0 +1,241 @@
+"""
+Utils for payments module
+
+Pagination cursors and offline ledger parsing and verification
+"""
+import asyncio
+import base64
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import hashlib
+import json
+import threading
+
+from app.crypto_utils import deserialize_public_key
+from app.crypto_utils.encryption_provider import EncryptionProvider
+from app.metrics import register_metrics
+from app.payments.datamodels import OfflineEncryptedTransaction
+from app.settings import (
+    SERVER_RSA_KEY_SIZE,
+    SIGNATURE_VERIFICATION_BATCH_SIZE,
+    SIGNATURE_VERIFICATION_WORKERS,
+    VERIFIED_KEY_CACHE_SIZE
+)
+from app.utils.cache import LRUCache
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+LEDGER_SEPERATOR = b"-----LEDGER SERPERATOR-----\n"
+
+PUBLIC_KEY_TRAILER = b"-----END PUBLIC KEY-----\n"
+
+# User key pairs are created with the server key size, so both signatures are as long
+USER_SIGNATURE_SIZE = SERVER_RSA_KEY_SIZE // 8
+SERVER_SIGNATURE_SIZE = SERVER_RSA_KEY_SIZE // 8
+
+# OpenSSL releases the GIL while verifying, so threads verify in parallel
+verification_executor = ThreadPoolExecutor(
+    max_workers=SIGNATURE_VERIFICATION_WORKERS,
+    thread_name_prefix="signature-verification"
+)
+
+# Deserialized public keys by SHA-256 of (public_key, public_key_signature)
+verified_key_cache = LRUCache(VERIFIED_KEY_CACHE_SIZE)
+register_metrics("verified_key_cache", verified_key_cache.metrics)
+
+
+def encode_cursor(transaction):
+    """
+    Create an opaque pagination cursor pointing after `transaction`
+    """
+    position = f"{transaction.timestamp.isoformat()}|{transaction.id}"
+    return base64.urlsafe_b64encode(position.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """
+    Decode (timestamp, id) from pagination cursor
+
+    :raises ValueError: if the cursor is invalid
+    """
+    try:
+        timestamp, transaction_id = base64.urlsafe_b64decode(cursor.encode("ascii"))\
+            .decode("utf-8").split("|", 1)
+        return datetime.fromisoformat(timestamp), transaction_id
+    except ValueError as exc:
+        raise ValueError("Invalid cursor") from exc
+
+
+def get_verified_public_key(public_key, public_key_signature):
+    """
+    Deserialize public key if its server signature is valid, None otherwise
+
+    Verified keys are cached, a ledger mostly has entries of few distinct keys
+    """
+    digest = hashlib.sha256(public_key)
+    digest.update(public_key_signature)
+    digest = digest.digest()
+
+    key = verified_key_cache.get(digest)
+    if key is None and EncryptionProvider.verify(public_key, public_key_signature):
+        key = deserialize_public_key(public_key)
+        verified_key_cache.set(digest, key)
+    return key
+
+
+def verify_ledger_entries(transactions, failed):
+    """
+    Verify server signature of public key and signature of data of offline transactions
+
+    Stops early if `failed` (a `threading.Event`) is set by another batch,
+    and sets it on failure
+    """
+    for transaction in transactions:
+        if failed.is_set():
+            return False
+        try:
+            public_key = get_verified_public_key(
+                transaction.public_key,
+                transaction.public_key_signature
+            )
+            valid = public_key is not None and EncryptionProvider.verify(
+                transaction.raw_data,
+                transaction.signature,
+                public_key
+            )
+        except ValueError:
+            valid = False
+        if not valid:
+            failed.set()
+            return False
+    return True
+
+
+class LedgerVerifier:
+    """
+    Verifies offline transactions in parallel batches as they are added
+
+    Fails fast, remaining batches are cancelled after the first invalid transaction
+    """
+    def __init__(self):
+        self.failed = threading.Event()
+        self._batch = []
+        self._pending = set()
+
+    def add(self, transaction):
+        """
+        Queue transaction for verification
+
+        :raises ValueError: if an invalid transaction has already been found
+        """
+        if self.failed.is_set():
+            raise ValueError("Ledger has invalid signatures")
+        self._batch.append(transaction)
+        if len(self._batch) >= SIGNATURE_VERIFICATION_BATCH_SIZE:
+            self._submit()
+
+    async def verify(self):
+        """
+        Wait for verification of all transactions, returns False if any is invalid
+        """
+        self._submit()
+        try:
+            while self._pending:
+                done, self._pending = await asyncio.wait(
+                    self._pending,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if not all(batch.result() for batch in done):
+                    return False
+            return True
+        finally:
+            self.cancel()
+
+    def cancel(self):
+        """
+        Stop verification of remaining transactions
+        """
+        self.failed.set()
+        for batch in self._pending:
+            batch.cancel()
+
+    def _submit(self):
+        """
+        Start verification of queued transactions
+        """
+        if self._batch:
+            self._pending.add(asyncio.wrap_future(
+                verification_executor.submit(verify_ledger_entries, self._batch, self.failed)
+            ))
+            self._batch = []
+
+
+class LedgerTooLargeError(ValueError):
+    """
+    Raised if an offline ledger exceeds the maximum size
+    """
+
+
+def parse_ledger_entry(buffer, start, end):
+    """
+    Parse the offline transaction in `buffer[start:end]`
+
+    :raises ValueError: if the entry is malformed
+    """
+    public_key_start = start + USER_SIGNATURE_SIZE + SERVER_SIGNATURE_SIZE
+
+    public_key_end = buffer.find(PUBLIC_KEY_TRAILER, public_key_start, end)
+    if public_key_end == -1:
+        raise ValueError("Public key not found in ledger entry")
+    public_key_end += len(PUBLIC_KEY_TRAILER)
+
+    # Fields are copied once out of the buffer, which is reused for the next entries
+    with memoryview(buffer) as view:
+        raw_data = bytes(view[public_key_end:end])
+        data = json.loads(raw_data)
+        if not isinstance(data, dict):
+            raise ValueError("Invalid ledger entry")
+        return OfflineEncryptedTransaction(
+            signature=bytes(view[start:start + USER_SIGNATURE_SIZE]),
+            public_key_signature=bytes(
+                view[start + USER_SIGNATURE_SIZE:public_key_start]
+            ),
+            public_key=bytes(view[public_key_start:public_key_end]),
+            raw_data=raw_data,
+            **data
+        )
+
+
+async def parse_ledger(chunks, max_size):
+    """
+    Parse offline transactions from a stream of ledger chunks
+
+    Each transaction is yielded as soon as the seperator following it arrives.
+    The parser only buffers the current chunk and the incomplete entry,
+    yielded transactions are held by the caller
+
+    :raises LedgerTooLargeError: if the ledger exceeds `max_size` bytes
+    :raises ValueError: if an entry is malformed
+    """
+    buffer = bytearray()
+    size = 0
+    async for chunk in chunks:
+        size += len(chunk)
+        if size > max_size:
+            raise LedgerTooLargeError(f"Ledger exceeds {max_size} bytes")
+
+        # Seperator may have been split across chunks
+        search_start = max(len(buffer) - len(LEDGER_SEPERATOR) + 1, 0)
+        buffer += chunk
+        start = 0
+        while True:
+            end = buffer.find(LEDGER_SEPERATOR, search_start)
+            if end == -1:
+                break
+            yield parse_ledger_entry(buffer, start, end)
+            start = search_start = end + len(LEDGER_SEPERATOR)
+        del buffer[:start]
+
+    # Last entry isn't followed by a seperator
+    if buffer:
+        yield parse_ledger_entry(buffer, 0, len(buffer))
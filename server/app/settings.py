@@ -1,7 +1,7 @@
 """
 Load all app settings from environment here
 """
-from os import environ
+from os import cpu_count, environ
 from app import DEBUG as _debug
 
 DEBUG = _debug
@@ -20,3 +20,101 @@ ACCESS_TOKEN_EXPIRE_MINUTES = int(environ.get("ACCESS_TOKEN_EXPIRY", 60 * 24 * 7
 USER_RSA_KEY_SIZE = 1024
 
 SERVER_RSA_KEY_SIZE = 2 * USER_RSA_KEY_SIZE
+
+# Keep a running balance per user, else balances are calculated from checkpoints.
+# Rebuild balances with `python -m app.payments.check_balances --rebuild` when turned back on
+MAINTAIN_BALANCES = environ.get("MAINTAIN_BALANCES", "True") != "False"
+
+# Checkpoint balance of users with atleast these many transactions since last checkpoint
+BALANCE_CHECKPOINT_DELTA_SIZE = int(environ.get("BALANCE_CHECKPOINT_DELTA_SIZE", 100))
+
+# Seconds between checkpoint runs if balances are not maintained, 0 disables the background job
+BALANCE_CHECKPOINT_INTERVAL = int(environ.get("BALANCE_CHECKPOINT_INTERVAL", 5 * 60))
+
+# Transactions newer than this (in seconds) aren't checkpointed, nor any after the start
+# of the oldest open db transaction
+BALANCE_CHECKPOINT_SETTLE_TIME = int(environ.get("BALANCE_CHECKPOINT_SETTLE_TIME", 60))
+
+# Number of ready key pairs kept in each key pool
+KEY_POOL_SIZE = int(environ.get("KEY_POOL_SIZE", 32))
+
+# Processes generating keys for the pools per server process, 0 disables pools (keys are
+# generated on request). Half of the cores are shared by the WEB_CONCURRENCY uvicorn workers
+KEY_POOL_WORKERS = int(environ.get(
+    "KEY_POOL_WORKERS",
+    max((cpu_count() or 1) // 2 // max(int(environ.get("WEB_CONCURRENCY", 1)), 1), 1)
+))
+
+# Threads verifying signatures of offline ledgers
+SIGNATURE_VERIFICATION_WORKERS = int(
+    environ.get("SIGNATURE_VERIFICATION_WORKERS", cpu_count() or 1)
+)
+
+# Ledger entries verified per task
+SIGNATURE_VERIFICATION_BATCH_SIZE = int(environ.get("SIGNATURE_VERIFICATION_BATCH_SIZE", 16))
+
+# Public keys of offline ledgers whose server signature has been verified
+VERIFIED_KEY_CACHE_SIZE = int(environ.get("VERIFIED_KEY_CACHE_SIZE", 1024))
+
+# Maximum size in bytes of an offline ledger upload
+MAX_LEDGER_SIZE = int(environ.get("MAX_LEDGER_SIZE", 8 * 1024 * 1024))
+
+# Authenticated users cached in process, and seconds before a cached user is reloaded
+USER_CACHE_SIZE = int(environ.get("USER_CACHE_SIZE", 10000))
+USER_CACHE_TTL = int(environ.get("USER_CACHE_TTL", 60))
+
+# Verified access tokens cached in process
+TOKEN_CACHE_SIZE = int(environ.get("TOKEN_CACHE_SIZE", 10000))
+
+# Cost of password hashes, existing hashes are upgraded on login
+BCRYPT_ROUNDS = int(environ.get("BCRYPT_ROUNDS", 12))
+
+# Threads hashing passwords, and jobs allowed to wait for them before rejecting logins
+PASSWORD_HASH_WORKERS = int(environ.get("PASSWORD_HASH_WORKERS", max((cpu_count() or 1) // 2, 1)))
+PASSWORD_HASH_QUEUE_SIZE = int(environ.get("PASSWORD_HASH_QUEUE_SIZE", 64))
+
+# Connections kept open per process, extra connections opened under load,
+# and seconds to wait for a connection before failing the request
+DATABASE_POOL_SIZE = int(environ.get("DATABASE_POOL_SIZE", 5))
+DATABASE_MAX_OVERFLOW = int(environ.get("DATABASE_MAX_OVERFLOW", 10))
+DATABASE_POOL_TIMEOUT = float(environ.get("DATABASE_POOL_TIMEOUT", 30))
+
+# Connections of the above given to asyncio sessions, overflow is split in proportion.
+# 0 opens a connection per asyncio session, outside of the above.
+# Blocking sessions keep at least one connection of a pool
+DATABASE_ASYNC_POOL_SIZE = int(environ.get(
+    "DATABASE_ASYNC_POOL_SIZE",
+    max(DATABASE_POOL_SIZE // 2, 1) if DATABASE_POOL_SIZE > 1 else 0
+))
+if DATABASE_POOL_SIZE and DATABASE_ASYNC_POOL_SIZE >= DATABASE_POOL_SIZE:
+    raise ValueError("DATABASE_ASYNC_POOL_SIZE has to be less than DATABASE_POOL_SIZE")
+
+# Seconds before a connection is replaced (-1 never), and whether connections are tested on checkout
+DATABASE_POOL_RECYCLE = int(environ.get("DATABASE_POOL_RECYCLE", -1))
+DATABASE_POOL_PRE_PING = environ.get("DATABASE_POOL_PRE_PING", "False") != "False"
+
+# Milliseconds a statement may run before postgres cancels it, 0 disables the limit
+DATABASE_STATEMENT_TIMEOUT = int(environ.get("DATABASE_STATEMENT_TIMEOUT", 0))
+
+# Offline transactions inserted per statement, the event loop is free between statements
+OFFLINE_INSERT_BATCH_SIZE = int(environ.get("OFFLINE_INSERT_BATCH_SIZE", 500))
+
+# Signature scheme of balance tokens, one of rsa, ed25519 or ecdsa-p256
+BALANCE_TOKEN_SCHEME = environ.get("BALANCE_TOKEN_SCHEME", "rsa")
+
+# Also sign balance tokens of other schemes with rsa, for clients that only verify rsa
+BALANCE_TOKEN_LEGACY_SIGNATURE = environ.get("BALANCE_TOKEN_LEGACY_SIGNATURE", "True") != "False"
+
+# Signed balance tokens cached per user,
+# and seconds a token is reused while the balance is unchanged
+BALANCE_TOKEN_CACHE_SIZE = int(environ.get("BALANCE_TOKEN_CACHE_SIZE", 10000))
+BALANCE_TOKEN_TTL = int(environ.get("BALANCE_TOKEN_TTL", 30))
+
+# Maximum ledger integrity certificates issued per request
+MAX_CERTIFICATE_BATCH_SIZE = int(environ.get("MAX_CERTIFICATE_BATCH_SIZE", 32))
+
+# Seconds clients and caches may reuse server public keys without revalidating
+SERVER_KEY_MAX_AGE = int(environ.get("SERVER_KEY_MAX_AGE", 60 * 60))
+
+# Bearer token required to read /metrics, metrics aren't served if unset
+METRICS_TOKEN = environ.get("METRICS_TOKEN")
@@ -1,11 +1,31 @@
 """
 App level tests
 """
+from fastapi.testclient import TestClient
+
+from app.auth import policies
 from app.main import app
 
+client = TestClient(app)
+
 def test_trailing_slashes():
     """
     Test for trailing slashes at the end of urls
     """
     exceptions = ('/',)
     assert all((route.path in exceptions or route.path[-1] != "/" for route in app.routes))
+
+
+def test_metrics_access(monkeypatch):
+    """
+    Test metrics are only served with the metrics token
+    """
+    assert client.get("/metrics").status_code == 403
+    assert client.get("/metrics", headers={"Authorization": "Bearer "}).status_code == 403
+
+    monkeypatch.setattr(policies, "METRICS_TOKEN", "metrics-token")
+    assert client.get("/metrics").status_code == 403
+    assert client.get("/metrics", headers={"Authorization": "Bearer other"}).status_code == 403
+    req = client.get("/metrics", headers={"Authorization": "Bearer metrics-token"})
+    assert req.status_code == 200
+    assert "token_cache" in req.json()
@@ -5,7 +5,19 @@ from datetime import datetime
 from uuid import uuid4
 import base64
 
+from app.crypto_utils import ServerKeys
 from app.crypto_utils.encryption_provider import EncryptionProvider
+from app.crypto_utils.enums import SignatureSchemes
+from app.metrics import register_metrics
+from app.settings import (
+    BALANCE_TOKEN_CACHE_SIZE,
+    BALANCE_TOKEN_LEGACY_SIGNATURE,
+    BALANCE_TOKEN_TTL
+)
+from app.utils.cache import LRUCache
+
+balance_token_cache = LRUCache(BALANCE_TOKEN_CACHE_SIZE, BALANCE_TOKEN_TTL)
+register_metrics("balance_token_cache", balance_token_cache.metrics)
 
 def uuid_to_string() -> str:
     """
@@ -14,15 +26,94 @@ def uuid_to_string() -> str:
     return str(uuid4())
 
 
+def balance_token_data(version, scheme, balance, timestamp):
+    """
+    Data signed in balance token
+
+    Version 1 is the original rsa only format, version 2 binds the signature scheme
+    """
+    if version == 1:
+        return f"{float(balance):.2f}{timestamp}".encode("utf-8")
+    return f"{version}:{scheme}:{float(balance):.2f}:{timestamp}".encode("utf-8")
+
+
 def sign_balance(balance):
     """
     Create balance token
+
+    `signature` is the version 1 rsa signature verified by existing clients. Schemes
+    other than rsa add a version 2 `scheme_signature`, the rsa signature is kept
+    alongside unless BALANCE_TOKEN_LEGACY_SIGNATURE is off
     """
     now = datetime.utcnow().isoformat()
-    return {
+    scheme = ServerKeys.balance_scheme
+    token = {
         "amount": balance,
         "timestamp": now,
-        "signature": base64.b64encode(
-            EncryptionProvider.sign((f"{float(balance):.2f}{now}").encode("utf-8"))
-        )
+        "version": 1,
+        "scheme": scheme.value,
     }
+    if scheme == SignatureSchemes.RSA or BALANCE_TOKEN_LEGACY_SIGNATURE:
+        token["signature"] = base64.b64encode(
+            EncryptionProvider.sign(
+                balance_token_data(1, SignatureSchemes.RSA.value, balance, now),
+                ServerKeys.private_key
+            )
+        )
+    if scheme != SignatureSchemes.RSA:
+        token["version"] = 2
+        token["scheme_signature"] = base64.b64encode(
+            EncryptionProvider.sign(
+                balance_token_data(2, scheme.value, balance, now),
+                ServerKeys.balance_private_key
+            )
+        )
+    return token
+
+
+def sign_user_balance(user_id, balance):
+    """
+    Create balance token of user
+
+    The last token of user is reused for `BALANCE_TOKEN_TTL` seconds if the balance is unchanged
+    """
+    token = balance_token_cache.get(user_id)
+    if token is None or token["amount"] != balance:
+        token = sign_balance(balance)
+        balance_token_cache.set(user_id, token)
+    return dict(token)
+
+
+def invalidate_balance_tokens(user_ids):
+    """
+    Remove cached balance tokens of users
+    """
+    for user_id in user_ids:
+        balance_token_cache.pop(user_id)
+
+
+def verify_balance_token(token):
+    """
+    Verify signatures of balance token created by `sign_balance`
+
+    Every signature present has to be valid
+    """
+    signatures = []
+    if "signature" in token:
+        signatures.append((
+            balance_token_data(1, SignatureSchemes.RSA.value, token["amount"], token["timestamp"]),
+            token["signature"],
+            ServerKeys.public_key
+        ))
+    if token.get("version", 1) == 2 and "scheme_signature" in token:
+        if token.get("scheme") != ServerKeys.balance_scheme.value:
+            return False
+        signatures.append((
+            balance_token_data(2, token["scheme"], token["amount"], token["timestamp"]),
+            token["scheme_signature"],
+            ServerKeys.balance_public_key
+        ))
+    return bool(signatures) and all(
+        EncryptionProvider.verify(data, base64.b64decode(signature), public_key)
+        for data, signature, public_key in signatures
+    )
@@ -0,0 +1,129 @@
+"""
+In process caches
+"""
+from collections import OrderedDict
+import heapq
+import threading
+import time
+
+
+class LRUCache:
+    """
+    Thread safe, bounded least recently used cache with hit and miss counters
+
+    Entries expire after `ttl` seconds if given
+    """
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """
+        Get value of `key`, `default` if missing
+        """
+        with self._lock:
+            try:
+                value, expires_at = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """
+        Set value of `key`, evicting the least recently used key if full
+
+        `ttl` overrides the default expiry of the cache
+        """
+        if self.maxsize <= 0:
+            return
+        ttl = ttl if ttl is not None else self.ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = value, expires_at
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        """
+        Remove `key` from cache
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """
+        Remove all keys from cache
+        """
+        with self._lock:
+            self._data.clear()
+
+    def metrics(self):
+        """
+        Size and hit rate of the cache
+        """
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class ExpiringSet:
+    """
+    Thread safe, unbounded set of keys that are dropped once they expire
+
+    Keys added without `ttl` never expire
+    """
+    def __init__(self):
+        self._data = {}
+        self._expiry = []
+        self._lock = threading.Lock()
+
+    def add(self, key, ttl=None):
+        """
+        Add `key` for `ttl` seconds
+        """
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._purge()
+            self._data[key] = expires_at
+            if expires_at is not None:
+                heapq.heappush(self._expiry, (expires_at, key))
+
+    def __contains__(self, key):
+        with self._lock:
+            if key not in self._data:
+                return False
+            expires_at = self._data[key]
+            return expires_at is None or expires_at > time.monotonic()
+
+    def __len__(self):
+        with self._lock:
+            self._purge()
+            return len(self._data)
+
+    def _purge(self):
+        """
+        Drop expired keys, lock has to be held
+        """
+        now = time.monotonic()
+        while self._expiry and self._expiry[0][0] <= now:
+            expires_at, key = heapq.heappop(self._expiry)
+            # Key may have been added again with a later expiry
+            if self._data.get(key, now + 1) == expires_at:
+                del self._data[key]
@@ -0,0 +1,7 @@
+#!/bin/sh
+
+export DATABASE_URL="$DATABASE_URL"_bench
+
+alembic upgrade head
+
+python -m benchmarks "$@"
@@ -0,0 +1,5 @@
+"""
+Micro-benchmarks of hot paths
+
+Run with `./bench.sh`, see `python -m benchmarks --help`
+"""
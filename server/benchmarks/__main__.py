@@ -0,0 +1,50 @@
+"""
+Benchmark entrypoint
+
+Exits with non zero status if any benchmark regressed against the baseline
+"""
+import argparse
+import logging
+import os
+import sys
+
+# pylint: disable=unused-import
+from benchmarks import bench_crud, bench_crypto, bench_ledger
+from benchmarks.harness import find_regressions, load_baseline, run_benchmarks, save_baseline
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+
+def main():
+    """
+    Run benchmarks, compare them with the baseline and optionally save them as the baseline
+    """
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument("-k", "--filter", default="", help="only run benchmarks containing this")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline json file")
+    parser.add_argument("--save", action="store_true", help="save results as the baseline")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="slowdown allowed before a regression is reported, 0.2 is 20%%")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per benchmark")
+    parser.add_argument("--min-time", type=float, default=0.2,
+                        help="minimum seconds per timed run")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    results = run_benchmarks(args.filter, args.repeat, args.min_time)
+
+    regressions = find_regressions(results, load_baseline(args.baseline), args.threshold)
+    for name, (baseline, current) in regressions.items():
+        logging.error(
+            "%s regressed: %.3f us/call, baseline %.3f us/call (%+.0f%%)",
+            name, current * 1e6, baseline * 1e6, (current / baseline - 1) * 100
+        )
+
+    if args.save:
+        save_baseline(results, args.baseline)
+        logging.info("Saved %d results to %s", len(results), args.baseline)
+    return len(regressions)
+
+
+if __name__ == "__main__":
+    sys.exit(1 if main() else 0)
@@ -0,0 +1,103 @@
+"""
+Benchmarks of balance and transaction queries over histories of increasing size
+
+Histories are seeded once per database and reused by later runs
+"""
+from functools import partial
+from os import environ
+
+from sqlalchemy import text
+
+from app.auth.db_crud import db_create_user, db_get_user_by_phone_number
+from app.crypto_utils import load_server_keys
+from app.database.connection import SessionLocal, engine
+from app.database.seed import create_user
+from app.payments.db_crud import (
+    db_calculate_balance,
+    db_list_transactions,
+    db_recalculate_balance
+)
+from app.payments.db_models import Balance
+from benchmarks.harness import benchmark
+
+ROW_COUNTS = [
+    int(count) for count in environ.get("BENCHMARK_ROW_COUNTS", "10,10000,1000000").split(",")
+]
+
+SEED_TRANSACTIONS = text("""
+    INSERT INTO transactions (id, type, sender_id, receiver_id, amount, timestamp, is_offline, created_at)
+    SELECT
+        :prefix || n,
+        'TRANSFER',
+        CASE WHEN n % 2 = 0 THEN :user_id ELSE :peer_id END,
+        CASE WHEN n % 2 = 0 THEN :peer_id ELSE :user_id END,
+        1,
+        now() - n * interval '1 second',
+        false,
+        now() - n * interval '1 second'
+    FROM generate_series(1, :count) AS n
+""")
+
+
+def _get_or_create_user(database, phone_number):
+    """
+    User with `phone_number`, created if missing
+    """
+    user = db_get_user_by_phone_number(database, phone_number, "id")
+    if user is None:
+        data = create_user()
+        data.phone_number = phone_number
+        user = db_create_user(database, data)
+    return user.id
+
+
+def seed_history(count):
+    """
+    User with `count` transfers with a peer, returns id of user
+    """
+    load_server_keys()
+    with SessionLocal() as database:
+        user_id = _get_or_create_user(database, f"+{10**13 + 2 * count}")
+        peer_id = _get_or_create_user(database, f"+{10**13 + 2 * count + 1}")
+        if not db_list_transactions(database, user_id=user_id, limit=1):
+            database.execute(SEED_TRANSACTIONS, {
+                "prefix": f"bench-{count}-",
+                "user_id": user_id,
+                "peer_id": peer_id,
+                "count": count,
+            })
+            for balance_user_id in (user_id, peer_id):
+                database.merge(Balance(
+                    user_id=balance_user_id,
+                    amount=db_recalculate_balance(database, balance_user_id)
+                ))
+            database.commit()
+            database.execute(text("ANALYZE transactions"))
+            database.commit()
+    return user_id
+
+
+def bench_calculate_balance(user_id):
+    """Balance of user"""
+    with SessionLocal() as database:
+        db_calculate_balance(database, user_id)
+
+
+def bench_recalculate_balance(user_id):
+    """Balance of user from the whole transaction history"""
+    with SessionLocal() as database:
+        db_recalculate_balance(database, user_id)
+
+
+def bench_list_transactions(user_id):
+    """First page of transactions of user"""
+    with SessionLocal() as database:
+        db_list_transactions(database, user_id=user_id, limit=50)
+
+
+if engine is not None:
+    for rows in ROW_COUNTS:
+        seed = partial(seed_history, rows)
+        benchmark(f"crud.calculate_balance[{rows}]", seed)(bench_calculate_balance)
+        benchmark(f"crud.recalculate_balance[{rows}]", seed)(bench_recalculate_balance)
+        benchmark(f"crud.list_transactions[{rows}]", seed)(bench_list_transactions)
@@ -0,0 +1,86 @@
+"""
+Benchmarks of signing, key generation and key serialization
+"""
+from app.crypto_utils import (
+    create_user_key_pair,
+    decrypt_private_key,
+    deserialize_public_key,
+    load_server_keys
+)
+from app.crypto_utils.datamodels import UserKeys
+from app.crypto_utils.db_models import Key
+from app.crypto_utils.encryption_provider import EncryptionProvider
+from app.utils import sign_balance
+from benchmarks.harness import benchmark
+
+MESSAGE = b"x" * 256
+
+
+def server_keys():
+    """
+    Load server keys once for signing benchmarks
+    """
+    load_server_keys()
+
+
+def signed_message():
+    """
+    Message with a server signature
+    """
+    server_keys()
+    return EncryptionProvider.sign(MESSAGE)
+
+
+def stored_key():
+    """
+    User key as stored in db
+    """
+    server_keys()
+    private_key, public_key = create_user_key_pair()
+    return Key(
+        public_key=public_key,
+        private_key=private_key,
+        public_key_signature=EncryptionProvider.sign(public_key)
+    )
+
+
+@benchmark("crypto.sign", server_keys)
+def bench_sign(_):
+    """Server signature of a message"""
+    EncryptionProvider.sign(MESSAGE)
+
+
+@benchmark("crypto.verify", signed_message)
+def bench_verify(signature):
+    """Verification of a server signature"""
+    EncryptionProvider.verify(MESSAGE, signature)
+
+
+@benchmark("crypto.create_user_key_pair")
+def bench_create_user_key_pair():
+    """Generation and serialization of a user key pair"""
+    create_user_key_pair()
+
+
+@benchmark("crypto.sign_balance", server_keys)
+def bench_sign_balance(_):
+    """Creation of a balance token"""
+    sign_balance(1234.5)
+
+
+@benchmark("crypto.user_keys_from_orm", stored_key)
+def bench_user_keys_from_orm(key):
+    """Serialization of stored user keys for a response"""
+    UserKeys.from_orm(key)
+
+
+@benchmark("crypto.decrypt_private_key", stored_key)
+def bench_decrypt_private_key(key):
+    """Decryption of a stored private key"""
+    decrypt_private_key(key.private_key, key.public_key)
+
+
+@benchmark("crypto.deserialize_public_key", stored_key)
+def bench_deserialize_public_key(key):
+    """Deserialization of a stored public key"""
+    deserialize_public_key(key.public_key)
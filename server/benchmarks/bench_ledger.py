@@ -0,0 +1,66 @@
+"""
+Benchmarks of offline ledger parsing
+"""
+import asyncio
+from datetime import datetime
+from functools import partial
+import json
+import os
+
+from app.crypto_utils import create_private_key, serialize_public_key
+from app.payments.utils import (
+    LEDGER_SEPERATOR,
+    SERVER_SIGNATURE_SIZE,
+    USER_SIGNATURE_SIZE,
+    parse_ledger
+)
+from app.utils import uuid_to_string
+from benchmarks.harness import benchmark
+
+CHUNK_SIZE = 64 * 1024
+
+
+def create_ledger(entries):
+    """
+    Ledger of `entries` transactions, signatures are random as parsing doesn't verify them
+    """
+    public_key = serialize_public_key(create_private_key().public_key())
+    timestamp = datetime.utcnow().timestamp()
+    ledger = []
+    for _ in range(entries):
+        data = json.dumps({
+            "id": uuid_to_string(),
+            "sender_id": uuid_to_string(),
+            "receiver_id": uuid_to_string(),
+            "amount": 100,
+            "timestamp": timestamp,
+        }).encode("utf-8")
+        signatures = os.urandom(USER_SIGNATURE_SIZE + SERVER_SIGNATURE_SIZE)
+        ledger.append(signatures + public_key + data)
+    return LEDGER_SEPERATOR.join(ledger)
+
+
+async def _chunks(ledger):
+    """
+    Stream ledger in chunks like a request body
+    """
+    for start in range(0, len(ledger), CHUNK_SIZE):
+        yield ledger[start:start + CHUNK_SIZE]
+
+
+async def _parse(ledger):
+    """
+    Parse all transactions of ledger
+    """
+    return [transaction async for transaction in parse_ledger(_chunks(ledger), len(ledger))]
+
+
+def bench_parse_ledger(ledger):
+    """Streaming parse of an offline ledger"""
+    asyncio.run(_parse(ledger))
+
+
+for entry_count in (10, 1000):
+    benchmark(
+        f"ledger.parse_ledger[{entry_count}]", partial(create_ledger, entry_count)
+    )(bench_parse_ledger)
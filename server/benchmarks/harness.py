@@ -0,0 +1,91 @@
+"""
+Calibrated benchmark runner with saved baselines
+"""
+from functools import partial
+import json
+import logging
+import timeit
+
+# name: (function, setup)
+_benchmarks = {}
+
+
+def benchmark(name, setup=None):
+    """
+    Register decorated function as benchmark `name`
+
+    `setup`, if given, is called once before timing and its result is passed to the function
+    """
+    def register(function):
+        _benchmarks[name] = (function, setup)
+        return function
+    return register
+
+
+def time_function(function, repeat=5, min_time=0.2):
+    """
+    Time `function`, calls per run are calibrated to take at least `min_time` seconds
+
+    Returns best and median seconds per call and calls per run
+    """
+    timer = timeit.Timer(function)
+    number, elapsed = timer.autorange()
+    if elapsed < min_time:
+        number = max(int(number * min_time / max(elapsed, 1e-9)), 1)
+    times = sorted(run / number for run in timer.repeat(repeat=repeat, number=number))
+    return {
+        "best": times[0],
+        "median": times[len(times) // 2],
+        "number": number,
+    }
+
+
+def run_benchmarks(name_filter="", repeat=5, min_time=0.2):
+    """
+    Run registered benchmarks whose name contains `name_filter`
+    """
+    results = {}
+    for name, (function, setup) in sorted(_benchmarks.items()):
+        if name_filter not in name:
+            continue
+        call = partial(function, setup()) if setup is not None else function
+        results[name] = time_function(call, repeat, min_time)
+        logging.info(
+            "%-48s %12.3f us/call (%d calls/run)",
+            name, results[name]["best"] * 1e6, results[name]["number"]
+        )
+    return results
+
+
+def save_baseline(results, filename):
+    """
+    Save results as baseline in `filename`, merged with results already saved there
+    """
+    baseline = load_baseline(filename)
+    baseline.update(results)
+    with open(filename, "w", encoding="utf-8") as baseline_file:
+        json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+
+
+def load_baseline(filename):
+    """
+    Load baseline saved by `save_baseline`, empty if missing
+    """
+    try:
+        with open(filename, encoding="utf-8") as baseline_file:
+            return json.load(baseline_file)
+    except FileNotFoundError:
+        return {}
+
+
+def find_regressions(results, baseline, threshold):
+    """
+    Benchmarks slower than baseline by more than `threshold` (0.2 is 20%)
+
+    Returns {name: (baseline seconds, current seconds)}, compared by best time
+    """
+    return {
+        name: (baseline[name]["best"], result["best"])
+        for name, result in results.items()
+        if name in baseline and result["best"] > baseline[name]["best"] * (1 + threshold)
+    }
@@ -1,3 +1,3 @@
 #!/bin/sh
 
-pylint app
\ No newline at end of file
+pylint app benchmarks
\ No newline at end of file